@@ -1,6 +1,6 @@
 from flask import Flask, request, jsonify, send_from_directory
 import threading
-from network import Peer
+from network import Peer, AsyncPeer
 import sys
 
 app = Flask(__name__, static_folder="static")
@@ -21,7 +21,9 @@ def api_init(username):
 
     try:
         peer_port = int(sys.argv[1])*5 if len(sys.argv) > 1 else 5000
-        peer = Peer(peer_port, username, tracker_host, tracker_port)
+        # `python -m app.app <port> async` runs the peer on an asyncio event loop
+        peer_class = AsyncPeer if len(sys.argv) > 2 and sys.argv[2] == "async" else Peer
+        peer = peer_class(peer_port, username, tracker_host, tracker_port)
         threading.Thread(target=peer.start, daemon=True).start()
         return jsonify({"message": f"Peer started for {username}"}), 200
     except Exception as e:
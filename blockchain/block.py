@@ -1,42 +1,141 @@
 import time
-import hashlib
 import json
+from blockchain.miner import hash_header, INITIAL_TARGET
+from blockchain.merkle import MerkleTree
 
-class Block:
+GENESIS_HASH = "0" * 63 + "1"
+
+class BlockHeader:
+    """
+        The part of a block that its hash covers: previous hash, merkle root,
+        timestamp, proof of work target and nonce. Headers are what peers exchange first when
+        syncing, since they can be linked and checked for proof of work
+        without the transactions.
+    """
+    def __init__(self, prev_hash: str, merkle_root: str, timestamp: float, nonce: int = 0,
+                 target: int = INITIAL_TARGET):
+        """
+            prev_hash: hash of previous block
+            merkle_root: root of the merkle tree over the block's txids
+            timestamp: when the block was made
+            nonce: a specific value that makes the hash fall below target
+            target: the hash, as an integer, must be below this, see
+                    Chain.target_after
+        """
+        self.prev_hash = prev_hash
+        self._merkle_root = merkle_root
+        self.timestamp = timestamp
+        self.target = target
+        self.genesis = False # only the chain's own first block, see Block
+        self._header = None # serialized header without the nonce
+        self.nonce = nonce
+
+    @property
+    def nonce(self):
+        return self._nonce
+
+    @nonce.setter
+    def nonce(self, value: int):
+        # the hash depends on the nonce, so drop the memoized one
+        self._nonce = value
+        self._hash = None
+
+    @property
+    def merkle_root(self) -> str:
+        return self._merkle_root
+
+    def header_prefix(self) -> bytes:
+        """
+            Serializes everything the hash covers except the nonce. Transactions
+            are only included through the merkle root, so the header has the
+            same size however many transactions the block holds. It is computed
+            once per block, the miner only appends nonces to it.
+        """
+        if self._header is None:
+            header_data = {
+                'prev_hash': self.prev_hash,
+                'merkle_root': self.merkle_root,
+                'timestamp': self.timestamp,
+                'target': self.target
+            }
+            # Sort_keys so order of keys is consistent
+            self._header = json.dumps(header_data, sort_keys=True).encode() + b"|"
+        return self._header
+
+    @property
+    def hash(self):
+        """
+            hash() combines all of the block's data and returns the hash based on it.
+            The result is memoized until the nonce changes. Only the genesis
+            block made by Chain.create_first_block has the constant
+            GENESIS_HASH; a received header can't claim it by its timestamp.
+        """
+        if self.genesis:
+            return GENESIS_HASH # genesis block hash
+
+        if self._hash is None:
+            self._hash = hash_header(self.header_prefix(), self.nonce)
+        return self._hash
+
+class Block(BlockHeader):
     """
         A block. Contains previous block's hash, a list of transactions,
         the nonce (to produce a hash with x no. of 0s), and the timestamp
         of the transaction.
     """
-    def __init__(self, prev_hash: str, transactions: list, nonce: int = 0, genesis: bool = False):
+    def __init__(self, prev_hash: str, transactions: list, nonce: int = 0, genesis: bool = False,
+                 signatures: list = None, target: int = INITIAL_TARGET):
         """
             prev_hash: hash of previous block. 64 0s for the first block
             transactions: list of transactions associated with this block
-            nonce: a specific value that makes hash start with X number of 0s
+            nonce: a specific value that makes the hash fall below target
             timestamp: when the block was made.
+            target: proof of work target, see BlockHeader
+            genesis: the chain's first block, whose hash is GENESIS_HASH
+            signatures: the payer's signature of each transaction, None for
+                        the mining reward. Kept so any node can check the
+                        block, but not covered by the hash (txids don't
+                        include signatures either).
         """
-        self.prev_hash = prev_hash
         self.transactions = transactions
-        self.nonce = nonce
-        self.timestamp = 0 if genesis else time.time()
+        self.signatures = signatures if signatures is not None else [None] * len(transactions)
+        self._tree = None # merkle tree of the transactions
+        super().__init__(prev_hash, None, 0 if genesis else time.time(), nonce, target)
+        self.genesis = genesis
         if genesis:
             print(f"Gensis block has a hash of {self.hash}")
 
     @property
-    def hash(self):
+    def merkle_tree(self) -> MerkleTree:
         """
-            hash() combines all of the block's data and returns the hash based on it.
+            Merkle tree over the txids, built once per block.
+        """
+        if self._tree is None:
+            self._tree = MerkleTree([tx.txid for tx in self.transactions])
+        return self._tree
+
+    @property
+    def merkle_root(self) -> str:
+        """
+            Commits to every transaction of the block in a fixed size.
+        """
+        return self.merkle_tree.root
+
+    def prove(self, txid: str) -> list:
+        """
+            Returns the merkle inclusion proof of a transaction in this block,
+            or None if the block doesn't contain it.
+        """
+        for index, tx in enumerate(self.transactions):
+            if tx.txid == txid:
+                return self.merkle_tree.proof(index)
+        return None
+
+    def header(self) -> BlockHeader:
+        """
+            The block's header without its transactions.
         """
-        if self.timestamp == 0:
-            return "0" * 63 + "1" # genesis block hash
-    
-        # turn block object into singular json entity
-        block_data = {
-            'prev_hash': self.prev_hash,
-            'transactions': [tx.to_dict() for tx in self.transactions],
-            'nonce': self.nonce,
-            'timestamp': self.timestamp
-        }
-        # Hash on entire json object. Sort_keys so order of keys is consistent
-        block_string = json.dumps(block_data, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
\ No newline at end of file
+        header = BlockHeader(self.prev_hash, self.merkle_root, self.timestamp, self.nonce, self.target)
+        header._hash = self._hash
+        header.genesis = self.genesis
+        return header
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+def block_work(block) -> int:
+    """
+        Expected number of hashes it took to mine a block at its target.
+    """
+    return 2 ** 256 // block.target
+
+class BlockIndexEntry:
+    """
+        What the block tree knows about one block.
+    """
+    def __init__(self, block, height: int, work: int):
+        """
+            block: the block itself
+            height: number of blocks between it and genesis
+            work: total work of the branch from genesis up to this block
+        """
+        self.block = block
+        self.height = height
+        self.work = work
+
+class BlockTree:
+    """
+        Every valid block this node knows about, not just the ones on the
+        active chain, keyed by hash. Blocks on side branches stay here so a
+        node can switch to them if they become heavier, and blocks whose
+        parent hasn't arrived yet wait in a bounded orphan pool.
+    """
+    def __init__(self, genesis_block, max_orphans: int = 100, height: int = 0, work: int = 0):
+        """
+            genesis_block: root of the tree. A chain restored from a snapshot
+                           roots it at the snapshot's block instead, with
+                           that block's height and cumulative work.
+            index: dict[block hash, BlockIndexEntry]
+            orphans: dict[block hash, block] of blocks with an unknown parent,
+                     oldest first
+            orphans_by_parent: dict[parent hash, set of orphan hashes]
+        """
+        self.index = {genesis_block.hash: BlockIndexEntry(genesis_block, height, work)}
+        self.max_orphans = max_orphans
+        self.orphans = OrderedDict()
+        self.orphans_by_parent = {}
+
+    def __contains__(self, block_hash: str):
+        return block_hash in self.index
+
+    def get(self, block_hash: str) -> BlockIndexEntry:
+        return self.index.get(block_hash)
+
+    def add(self, block, check=None) -> list:
+        """
+            Indexes a block whose parent is known, then any orphans that were
+            waiting for it. Returns the new entries. A block with an unknown
+            parent goes to the orphan pool and nothing is returned.
+
+            check: check(block, parent entry) -> bool, run before indexing a
+                   block. A block failing it is dropped, together with the
+                   orphans that were waiting for it.
+        """
+        parent = self.index.get(block.prev_hash)
+        if parent is None:
+            self.add_orphan(block)
+            return []
+
+        added = []
+        pending = [(block, parent)]
+        while pending:
+            block, parent = pending.pop()
+            if check is not None and not check(block, parent):
+                for orphan_hash in self.orphans_by_parent.pop(block.hash, ()):
+                    self.orphans.pop(orphan_hash, None)
+                continue
+            entry = BlockIndexEntry(block, parent.height + 1, parent.work + block_work(block))
+            self.index[block.hash] = entry
+            added.append(entry)
+            for orphan_hash in self.orphans_by_parent.pop(block.hash, ()):
+                orphan = self.orphans.pop(orphan_hash, None)
+                if orphan is not None:
+                    pending.append((orphan, entry))
+        return added
+
+    def discard(self, block_hash: str):
+        """
+            Forgets an invalid block and every known block built on it, so
+            they are never chosen as the best branch again.
+        """
+        doomed = {block_hash}
+        for entry in sorted(self.index.values(), key=lambda entry: entry.height):
+            if entry.block.prev_hash in doomed:
+                doomed.add(entry.block.hash)
+        for doomed_hash in doomed:
+            self.index.pop(doomed_hash, None)
+        for orphan_hash in self.orphans_by_parent.pop(block_hash, ()):
+            self.orphans.pop(orphan_hash, None)
+
+    def add_orphan(self, block):
+        """
+            Keeps a block until its parent arrives, evicting the oldest
+            orphan once the pool is full.
+        """
+        if block.hash in self.orphans:
+            return
+        self.orphans[block.hash] = block
+        self.orphans_by_parent.setdefault(block.prev_hash, set()).add(block.hash)
+        if len(self.orphans) > self.max_orphans:
+            old_hash, old = self.orphans.popitem(last=False)
+            siblings = self.orphans_by_parent.get(old.prev_hash)
+            if siblings is not None:
+                siblings.discard(old_hash)
+                if not siblings:
+                    del self.orphans_by_parent[old.prev_hash]
+
+    def branch(self, tip_hash: str, stop) -> list:
+        """
+            Walks back from tip_hash until stop(entry) is True and returns the
+            entries passed, oldest first, together with the entry it stopped at.
+        """
+        entries = []
+        entry = self.index[tip_hash]
+        while not stop(entry):
+            entries.append(entry)
+            entry = self.index[entry.block.prev_hash]
+        entries.reverse()
+        return entries, entry
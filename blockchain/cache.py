@@ -0,0 +1,61 @@
+from collections import OrderedDict
+import threading
+
+class LRUCache:
+    """
+        Bounded mapping that evicts the least recently used entry once it
+        holds maxsize entries. Counts hits and misses so callers can see how
+        well it works.
+    """
+    def __init__(self, maxsize: int):
+        """
+            maxsize: most entries kept at once
+            hits/misses: lookups that did/didn't find their key
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+            Returns the value for key and marks it as recently used.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+            Stores value under key, evicting the oldest entry if full.
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+            Removes key and returns its value.
+        """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """
+            Returns the hit/miss counters and current size.
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
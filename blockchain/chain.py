@@ -1,47 +1,256 @@
 from blockchain.wallet import Wallet
 from blockchain.transaction import Transaction
 from blockchain.block import Block
+from blockchain.mempool import Mempool
+from blockchain.blocktree import BlockTree
+from blockchain.store import BlockStore, StoredChain, StoredHeights
+from blockchain.snapshot import Snapshot, latest_snapshot
+from blockchain.template import BlockTemplate, block_size, MAX_BLOCK_TRANSACTIONS, MAX_BLOCK_BYTES
+from blockchain.miner import Miner, ParallelMiner, meets_target, retarget, MAX_TARGET, RETARGET_INTERVAL
 from ecdsa import SigningKey, VerifyingKey, SECP256k1
 import base64
+import os
+import time
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from blockchain.cache import LRUCache
+
+# parsed verifying keys by public key hex, so the curve point is only
+# decompressed once per key
+_verifying_keys = LRUCache(4096)
+# (txid, signature) pairs that already passed verification
+_verified_signatures = LRUCache(65536)
+
+def get_verifying_key(public_hex: str) -> VerifyingKey:
+    """
+        Returns the parsed VerifyingKey of a public key hex, from cache if possible.
+        Keys are not precomputed: that costs several verifies' worth of time
+        and ~47 KB per key, which a burst of many different payers never
+        earns back.
+    """
+    vk = _verifying_keys.get(public_hex)
+    if vk is None:
+        vk = VerifyingKey.from_string(bytes.fromhex(public_hex), curve=SECP256k1)
+        _verifying_keys.put(public_hex, vk)
+    return vk
 
 def verify(data: str, signature: str, public_hex: str) -> bool:
     """
         Verifies signature with a user's public key.
     """
     try:
-        vk = VerifyingKey.from_string(bytes.fromhex(public_hex), curve=SECP256k1)
+        vk = get_verifying_key(public_hex)
         return vk.verify(base64.b64decode(signature), data.encode())
     except Exception:
         return False
+
+def verify_transaction(transaction: Transaction, signature: str) -> bool:
+    """
+        Verifies the signature of a transaction. The txid covers the signed
+        message and the payer's key, so a (txid, signature) pair
+        that verified once is remembered and not checked again when the same
+        transaction shows up later (e.g. local submit, then gossip).
+    """
+    key = (transaction.txid, signature)
+    if _verified_signatures.get(key):
+        return True
+    if not verify(transaction.to_sign(), signature, transaction.payer.public_key):
+        return False
+    _verified_signatures.put(key, True)
+    return True
+
+MAX_CLOCK_DRIFT = 2 * 60 * 60 # seconds a block's timestamp may be ahead of ours
+MIN_BLOCK_SPACING = 0.001 # seconds a block is dated after its parent at least
+SNAPSHOT_DEPTH = 10 # default blocks a snapshot stays below the tip, so a restarted node can still reorg that deep
+
+_verify_pool = None # process pool for verify_transactions, started on first use
+
+def _get_verify_pool() -> ProcessPoolExecutor:
+    """
+        Starts the signature verification processes on first use.
+    """
+    global _verify_pool
+    if _verify_pool is None:
+        _verify_pool = ProcessPoolExecutor(os.cpu_count(),
+                                           mp_context=multiprocessing.get_context("spawn"))
+    return _verify_pool
+
+def _verify_chunk(items: list) -> list:
+    """
+        Runs in a pool process. Verifies (data, signature, public_hex) triples.
+    """
+    return [verify(data, signature, public_hex) for data, signature, public_hex in items]
+
+def verify_transactions(batch: list, chunk_size: int = 128, min_parallel: int = 256) -> list:
+    """
+        Verifies the signatures of a batch of (transaction, signature) pairs
+        and returns one bool per pair. Pairs that are not cached yet are split
+        into chunks and checked in a process pool when there are at least
+        min_parallel of them, otherwise inline. Valid pairs are added to the
+        signature cache, so recv_transaction won't check them again.
+    """
+    results = [False] * len(batch)
+    pending = [] # indices into batch that still need an ECDSA check
+    for i, (transaction, signature) in enumerate(batch):
+        if _verified_signatures.get((transaction.txid, signature)):
+            results[i] = True
+        else:
+            pending.append(i)
+
+    # only plain strings go to the workers, never the payer's Wallet
+    items = [(batch[i][0].to_sign(), batch[i][1], batch[i][0].payer.public_key) for i in pending]
+    if len(items) >= min_parallel and (os.cpu_count() or 1) > 1:
+        chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+        checked = [ok for chunk in _get_verify_pool().map(_verify_chunk, chunks) for ok in chunk]
+    else:
+        checked = _verify_chunk(items)
+
+    for i, ok in zip(pending, checked):
+        results[i] = ok
+        if ok:
+            transaction, signature = batch[i]
+            _verified_signatures.put((transaction.txid, signature), True)
+    return results
+
+def verify_cache_stats() -> dict:
+    """
+        Returns hit/miss counters of the verifying key and signature caches.
+    """
+    return {
+        "verifying_keys": _verifying_keys.stats(),
+        "signatures": _verified_signatures.stats()
+    }
     
 class Chain:
     """
         The 'block-chain'. Responsible for adding blocks, managing balances,
         and mining blocks.
     """
-    def __init__(self):
+    def __init__(self, mining_workers: int = 1, store: BlockStore = None, snapshot_interval: int = 100,
+                 snapshot_depth: int = SNAPSHOT_DEPTH):
         """
             Sets up the chain with a genesis transaction and wallet.
 
+            mining_workers: processes used for mining. 1 mines in the calling
+                            thread, None uses one process per core.
+            store: optional BlockStore keeping the blocks on disk. Blocks
+                   already in it are loaded instead of starting from genesis.
+            snapshot_interval: with a store, a Snapshot of the state is saved
+                               every this many blocks, snapshot_depth blocks
+                               below the tip, and startup replays only the
+                               blocks after the newest one
+            snapshot_depth: how deep a node restarted from a snapshot can
+                            still reorganize
+
             coinbase: the 'bank', source of reward crypto and initial 100 coins
             balances: dict of balances for each wallet,
             reward: reward of mining one block
             genesis_block: the very first block where coinbase gives the first
                            user 100 coins
             genesis_wallet: the first 'real' user (Satoshi Nakamoto)
-            chain: The actual 'chain', represented as a list of blocks
-            mempool: list of transactions not commited to blockchain yet
+            chain: The actual 'chain', represented as a list of blocks (or a
+                   StoredChain reading them from the store)
+            tip_hash: hash of chain[-1], a plain attribute that the miner can
+                      poll from another thread
+            mempool: transactions not commited to blockchain yet, see Mempool
+            tx_index: txid -> height of the block the transaction is in
+            block_heights: block hash -> height, for blocks on the chain (a
+                           StoredHeights view of the store's hash index
+                           when there is one)
+            tree: index of every known block with its height and cumulative
+                  work, plus orphans, see BlockTree. With a store, blocks
+                  on the active chain only keep their header there
+            undo_records: for every block on the chain, what it changed in
+                          balances, so disconnect_block can reverse it
+            miner: proof of work engine used by mine_block, either a Miner or
+                   a ParallelMiner depending on mining_workers
+            template: BlockTemplate picking the transactions of the next
+                      block mine_block makes
         """
         self.coinbase = Wallet("coinbase")
         self.coinbase_public_key = '0x0'
         self.balances = {} # dict[Wallet.public_key(str), balance(float)]
         self.reward = 50 # reward for mining
+        self.miner = Miner() if mining_workers == 1 else ParallelMiner(mining_workers)
 
         genesis_block, self.genesis_wallet = self.create_first_block()
-        self.chain = [genesis_block]
-        self.mempool: list[tuple[Transaction, str]] = [] # List of (tx, signature)
-        self.update_balances(genesis_block.transactions[0])
+        self.mempool = Mempool() # (tx, signature) pairs by txid
+        self.tx_index = {} # dict[txid, height of the block that commited it]
+        self.block_heights = {} # dict[block hash, height] for blocks on the chain
+        self.tree = BlockTree(genesis_block) # every known block, including side branches
+        self.undo_records = {} # dict[block hash, balance changes made by the block]
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_depth = snapshot_depth
+        self.snapshot_dir = None # where snapshots go, next to the store
+        snapshot = None
+        if store is None:
+            self.chain = [genesis_block]
+        else:
+            self.chain = StoredChain(store)
+            self.block_heights = StoredHeights(store)
+            self.snapshot_dir = os.path.join(store.directory, "snapshots")
+            if len(store) == 0:
+                self.chain.append(genesis_block)
+            snapshot = latest_snapshot(self.snapshot_dir, store)
+        if snapshot is not None:
+            self.restore_snapshot(snapshot)
+            self.load_blocks(snapshot.height + 1)
+        else:
+            self.update_balances(genesis_block.transactions[0], reward=True)
+            self.index_block(genesis_block, 0)
+            self.load_blocks(1)
+        self.tip_hash = self.hash_at(len(self.chain) - 1) # kept by connect/disconnect_block
+        self.template = BlockTemplate(self) # transactions for the next mined block
         
+    def restore_snapshot(self, snapshot: Snapshot):
+        """
+            Takes the state from a snapshot instead of replaying the blocks up
+            to it. The block tree starts at the snapshot's block, so a reorg
+            can't reach below it after a restart. The snapshot is at least
+            snapshot_depth blocks below the stored tip, and load_blocks()
+            rebuilds the tree entries and undo records of the blocks above it.
+        """
+        self.balances = dict(snapshot.balances)
+        self.tx_index = dict(snapshot.tx_index)
+        self.tree = BlockTree(self.chain[snapshot.height].header(), height=snapshot.height, work=snapshot.work)
+        print(f"Restored state at height {snapshot.height} from a snapshot")
+
+    def save_snapshot(self, height: int):
+        """
+            Saves the state right after the block at height, a few blocks
+            below the tip: balances are rolled back with the undo records of
+            the blocks above it. The store is flushed first so the snapshot
+            never refers to blocks that aren't on disk.
+        """
+        store = self.chain.store
+        entry = self.tree.get(store.hash_at(height))
+        balances = dict(self.balances)
+        for above in range(len(store) - 1, height, -1):
+            for public_key, (delta, created) in self.undo_records[store.hash_at(above)].items():
+                balance = balances.get(public_key, 0) - delta
+                if created and balance == 0:
+                    balances.pop(public_key, None)
+                else:
+                    balances[public_key] = balance
+        tx_index = {txid: tx_height for txid, tx_height in self.tx_index.items() if tx_height <= height}
+        store.flush()
+        Snapshot(height, entry.block.hash, entry.work, balances, tx_index).save(self.snapshot_dir)
+
+    def load_blocks(self, start: int):
+        """
+            Applies the stored blocks from height start on to balances and the
+            indexes, when a node restarts on top of an existing store. Only
+            headers are kept in the block tree, the bodies stay on disk.
+        """
+        for height in range(start, len(self.chain)):
+            block = self.chain[height]
+            self.tree.add(block.header())
+            self.connect_block(block, height)
+        if len(self.chain) > start:
+            print(f"Loaded {len(self.chain) - start} blocks from the store")
+
+
     def create_first_block(self):
         """
         Creates the genesis block of the blockchain.
@@ -57,13 +266,58 @@ class Chain:
                 if a user has enough money to make the transaction
             Put transaction into mempool if it is valid.
         """
-        if not verify(transaction.to_sign(), sign, transaction.payer.public_key):
+        if self.has_transaction(transaction.txid):
+            status = "Transaction already known, transaction rejected."
+            print(status)
+            return False, status
+
+        if not verify_transaction(transaction, sign):
             status = "Invalid signature, transaction rejected."
             print(status)
             return False, status
-        
-        if (transaction.payer != "coinbase" and 
-            (self.get_effective_balance(transaction.payer) < transaction.amount) and not receiving):
+        return self.admit_transaction(transaction, sign, receiving)
+
+    def recv_transactions(self, batch: list, receiving: bool):
+        """
+            recv_transaction() for a batch of (transaction, signature) pairs.
+            Signatures are checked together by verify_transactions(), then the
+            balance checks run in order. Returns one (success, status) per pair.
+        """
+        # don't spend signature checks on transactions we already have
+        fresh = [(tx, sign) for tx, sign in batch if not self.has_transaction(tx.txid)]
+        verified = dict(zip((tx.txid for tx, _ in fresh), verify_transactions(fresh)))
+        results = []
+        for transaction, sign in batch:
+            ok = verified.get(transaction.txid)
+            if ok is None:
+                status = "Transaction already known, transaction rejected."
+                print(status)
+                results.append((False, status))
+            elif not ok:
+                status = "Invalid signature, transaction rejected."
+                print(status)
+                results.append((False, status))
+            else:
+                results.append(self.admit_transaction(transaction, sign, receiving))
+        return results
+
+    def admit_transaction(self, transaction: Transaction, sign: str, receiving: bool):
+        """
+            The checks of recv_transaction() that come after the signature.
+            Puts the transaction into the mempool if they pass.
+        """
+        if transaction.is_coinbase:
+            status = "Coinbase only pays mining rewards, transaction rejected."
+            print(status)
+            return False, status
+
+        if not (math.isfinite(transaction.amount) and transaction.amount > 0):
+            # NaN passes every comparison, balance checks included
+            status = "Cannot give negative money, transaction rejected."
+            print(status)
+            return False, status
+
+        if (self.get_effective_balance(transaction.payer) < transaction.amount) and not receiving:
             status = "Not enough money, transaction rejected."
             print(status)
             return False, status
@@ -73,71 +327,563 @@ class Chain:
             print(status)
             return False, status
         
-        if (transaction.amount <= 0):
-            status = "Cannot give negative money, transaction rejected."
+        if self.has_transaction(transaction.txid) or not self.mempool.add(transaction, sign):
+            status = "Transaction already known, transaction rejected."
             print(status)
             return False, status
-        
-        self.mempool.append((transaction, sign))
+        self.template.add(transaction, sign)
         status = "Transaction added to mempool"
         print(status)
         return True, status
 
-    def mine_block(self, miner: Wallet):
+    def prepare_block(self, miner: Wallet) -> Block:
         """
-            Iterates over nonce values until it produces a hash starting with
-            X number of 0s. Once mined, calls add_block to append to the chain.
+            Builds the next block on the current tip: the mining reward, the
+            BlockTemplate's transactions and the target. Reads chain state, so
+            callers serialize it with other chain updates. The block owns its
+            lists, so it stays the same while the chain moves on. Re-arms the
+            miner, so a cancel_mining() from here on stops the search.
         """
+        self.miner.reset()
         reward_tx = Transaction(self.reward, self.coinbase, miner.public_key)
-        transactions = [reward_tx] + [tx for tx, _ in self.mempool]
+        selected, selected_signatures = self.template.select()
+        transactions = [reward_tx] + selected
+        signatures = [None] + selected_signatures
+        parent = self.chain[-1]
+        target = self.target_after(parent, len(self.chain) - 1)
+        block = Block(self.tip_hash, transactions, signatures=signatures, target=target)
+        # must be dated after the parent, even one from a fast clock
+        block.timestamp = max(block.timestamp, parent.timestamp + MIN_BLOCK_SPACING)
+        return block
 
-        prev_hash = self.chain[-1].hash
-        nonce = 0
-        while True:
-            block = Block(prev_hash, transactions, nonce)
-            if self.chain[-1].hash != prev_hash: # other peer won
-                return False
-            if block.hash.startswith("0000"):
-                break
-            nonce += 1
-        
-        print(f"{miner.name} Block mined!")
+    def search_block(self, block: Block) -> bool:
+        """
+            Iterates over nonce values until the block's hash is below its
+            target. Only the serialized header and tip_hash are read, so it
+            runs without any lock while blocks and transactions keep being
+            handled. Gives up when the tip moves or cancel_mining() is called.
+            Returns whether a nonce was found.
+        """
+        nonce = self.miner.search(block.header_prefix(), block.target,
+                                  should_stop=lambda: self.tip_hash != block.prev_hash)
+        if nonce is None: # other peer won
+            return False
+        block.nonce = nonce
+        return True
+
+    def mine_block(self, miner: Wallet):
+        """
+            Iterates over nonce values until it produces a hash below the
+            target, see prepare_block and search_block. Returns the block,
+            which the caller passes to add_block, or False if the tip moved.
+        """
+        block = self.prepare_block(miner)
+        if not self.search_block(block):
+            return False
+        worker_rates = ", ".join(f"{rate:.0f}" for rate in self.miner.worker_hashrates)
+        print(f"{miner.name} Block mined! ({self.miner.hashrate:.0f} H/s, per worker: {worker_rates})")
         return block
 
-    def add_block(self, block: Block):
+    def cancel_mining(self):
+        """
+            Stops a mine_block call running in another thread, e.g. because
+            a competing block for the same height arrived.
+        """
+        self.miner.cancel()
+
+    def accept_block(self, block: Block) -> str:
+        """
+            Takes in a block from any branch and returns what happened to it:
+                "duplicate": already known
+                "invalid": failed check_block() or fits_parent(), or failed
+                           check_transitions() when its branch was connected
+                "orphan": parent unknown, kept in the orphan pool
+                "side": stored on a branch lighter than the active chain
+                "extended": appended to the active chain
+                "reorganized": made a side branch the heaviest, so the chain
+                               switched to it
+        """
+        if block.hash in self.tree or block.hash in self.tree.orphans:
+            return "duplicate"
+        error = self.check_block(block)
+        if error is not None:
+            print(f"[accept_block] block {block.hash[:8]} rejected: {error}")
+            return "invalid"
+
+        parent = self.tree.get(block.prev_hash)
+        if parent is not None and not self.fits_parent(block, parent):
+            return "invalid"
+
+        # orphans connected by this block get the same checks
+        added = self.tree.add(block, self.fits_parent)
+        if not added:
+            return "orphan"
+        best = max(added, key=lambda entry: entry.work)
+        tip = self.tree.get(self.tip_hash)
+        if best.work <= tip.work:
+            return "side"
+
+        # walk back from the new tip to the first block on the active chain
+        entries, fork = self.tree.branch(best.block.hash, self.on_active_chain)
+        if not self.reorganize(fork.height, [entry.block for entry in entries]):
+            return "invalid"
+        return "extended" if fork is tip else "reorganized"
+
+    def check_block(self, block: Block) -> str:
+        """
+            The checks that don't depend on the chain state: proof of work
+            against the block's own target, a timestamp not too far ahead, one
+            signature slot per transaction, the block size limits of
+            BlockTemplate, no transaction twice, and a first transaction that is
+            the mining reward and the only one paid by coinbase. Returns what
+            is wrong, or None for a valid block. The target itself, signatures
+            and balances are left to check_transitions(), once the parent is
+            connected.
+        """
+        if not 0 < block.target <= MAX_TARGET or not meets_target(block.hash, block.target):
+            return "no valid proof of work"
+        if not 0 < block.timestamp <= time.time() + MAX_CLOCK_DRIFT:
+            return "timestamp not positive or too far in the future"
+        if not block.transactions or len(block.signatures) != len(block.transactions):
+            return "malformed transaction list"
+        if len(block.transactions) > MAX_BLOCK_TRANSACTIONS or block_size(block) > MAX_BLOCK_BYTES:
+            return "block too large"
+        txids = [tx.txid for tx in block.transactions]
+        if len(set(txids)) != len(txids):
+            # repeating the last transactions of a level leaves the merkle
+            # root unchanged (CVE-2012-2459), so this copy has the real
+            # block's hash and must never get into the tree
+            return "duplicate transaction"
+        reward = block.transactions[0]
+        if not reward.is_coinbase or reward.amount != self.reward:
+            return "first transaction is not the mining reward"
+        if any(tx.is_coinbase for tx in block.transactions[1:]):
+            return "coinbase pays outside the mining reward"
+        return None
+
+    def verify_blocks(self, blocks: list) -> bool:
+        """
+            Verifies every signature in a list of blocks at once with
+            verify_transactions(), spread over its process pool for large
+            branches. Valid signatures land in the signature cache, so the
+            sequential check_transitions() pass doesn't redo the ECDSA work.
+        """
+        batch = [(tx, sign) for block in blocks
+                 for tx, sign in zip(block.transactions[1:], block.signatures[1:])
+                 if sign is not None]
+        return all(verify_transactions(batch))
+
+    def fits_parent(self, block: Block, parent) -> bool:
+        """
+            Whether a block fits on top of its parent's block tree entry: it
+            uses the target target_after() expects and is dated after the
+            parent. Checked before a block is stored, so a side branch can't
+            fill the tree with blocks mined at an easy target.
+        """
+        if block.target != self.target_after(parent.block, parent.height):
+            error = "wrong proof of work target"
+        elif block.timestamp <= parent.block.timestamp:
+            error = "timestamp not after its parent's"
+        else:
+            return True
+        print(f"[fits_parent] block {block.hash[:8]} rejected: {error}")
+        return False
+
+    def check_transitions(self, block: Block) -> str:
+        """
+            Checks a block against the state at the current tip, which must
+            be its parent: the target target_after() expects, a timestamp
+            after the parent's, and every transaction signed by its payer, not
+            already on the chain, and for a positive amount the payer still
+            has after the block's earlier transactions. Returns what is
+            wrong, or None.
+        """
+        if block.prev_hash != self.tip_hash:
+            return "does not extend the tip"
+        if block.target != self.target_after(self.chain[-1], len(self.chain) - 1):
+            return "wrong proof of work target"
+        if block.timestamp <= self.chain[-1].timestamp:
+            return "timestamp not after its parent's"
+        delta = {} # dict[public key, change made by the block so far]
+        seen = set()
+        for tx, sign in zip(block.transactions[1:], block.signatures[1:]):
+            error = self.check_transaction(tx, sign, delta, seen)
+            if error is not None:
+                return error
+        return None
+
+    def check_transaction(self, transaction: Transaction, sign: str, delta: dict, seen: set) -> str:
+        """
+            Checks one transaction of a block being built or connected, given
+            the balance changes (delta) and txids (seen) of the transactions
+            before it. Returns what is wrong, or None after recording the
+            transaction in delta and seen.
+        """
+        txid = transaction.txid
+        if transaction.is_coinbase:
+            return f"transaction {txid[:8]} is paid by coinbase outside the mining reward"
+        if txid in seen or txid in self.tx_index:
+            return f"transaction {txid[:8]} is already on the chain"
+        if not (math.isfinite(transaction.amount) and transaction.amount > 0):
+            return f"transaction {txid[:8]} has a non-positive or non-finite amount"
+        if sign is None or not verify_transaction(transaction, sign):
+            return f"transaction {txid[:8]} has an invalid signature"
+        payer = transaction.payer.public_key
+        if self.balances.get(payer, 0) + delta.get(payer, 0) < transaction.amount:
+            return f"transaction {txid[:8]} spends more than its payer has"
+        seen.add(txid)
+        delta[payer] = delta.get(payer, 0) - transaction.amount
+        delta[transaction.payee_public_key] = delta.get(transaction.payee_public_key, 0) + transaction.amount
+        return None
+
+    def target_after(self, parent, parent_height: int, pending: dict = None) -> int:
+        """
+            The target a block on top of parent must use. It stays the same
+            except every RETARGET_INTERVAL blocks, where retarget() scales it
+            by how long the last RETARGET_INTERVAL - 1 block intervals
+            actually took. The window never starts at genesis, which has no
+            real timestamp. Miners choose the timestamps, but every block must
+            be dated after its parent (fits_parent, check_headers), so dating
+            a window's last block ahead only moves the next window's start
+            along with it: a 4x easier target can't be repeated window after
+            window.
+
+            pending: dict[hash, header] of headers not in the block tree yet
+                     (see check_headers), looked up before the tree
+        """
+        height = parent_height + 1
+        if height % RETARGET_INTERVAL != 0 or height == RETARGET_INTERVAL:
+            return parent.target
+        first = self.ancestor(parent, parent_height, height - RETARGET_INTERVAL, pending)
+        return retarget(parent.target, parent.timestamp - first.timestamp, RETARGET_INTERVAL - 1)
+
+    def ancestor(self, header, height: int, ancestor_height: int, pending: dict = None):
+        """
+            Walks back from a header at height to its ancestor at
+            ancestor_height, through pending headers and the block tree. Below
+            the tree's root (a snapshot's block) the branch is the active chain.
+        """
+        while height > ancestor_height:
+            parent = pending.get(header.prev_hash) if pending else None
+            if parent is None:
+                entry = self.tree.get(header.prev_hash)
+                if entry is None:
+                    return self.chain[ancestor_height]
+                parent = entry.block
+            header = parent
+            height -= 1
+        return header
+
+    def on_active_chain(self, entry) -> bool:
+        """
+            Whether a block tree entry is part of the active chain.
+        """
+        return self.block_heights.get(entry.block.hash) == entry.height
+
+    def add_block(self, block: Block, revalidate: bool = True):
         """
             Appends a block to the blockchain and removes the transactions
-            in the block from the mempool.
+            in the block from the mempool. With a store the body is on disk
+            now, so the block tree only keeps its header.
+
+            revalidate: run revalidate_mempool() on the new tip. reorganize()
+                        only does it once the whole branch is connected.
         """
+        if block.hash not in self.tree:
+            self.tree.add(block)
         self.chain.append(block)
-        for tx in block.transactions:
-            self.update_balances(tx)
-        
-        block_transactions = [tx.to_dict() for tx in block.transactions]
+        height = len(self.chain) - 1
+        self.connect_block(block, height)
+        if isinstance(self.chain, StoredChain):
+            self.tree.get(block.hash).block = block.header()
+        snapshot_height = height - self.snapshot_depth
+        if self.snapshot_dir is not None and snapshot_height > 0 and snapshot_height % self.snapshot_interval == 0:
+            # deep enough that the blocks above it can still be disconnected
+            # after a restart
+            self.save_snapshot(snapshot_height)
 
         # keep transactions that were not in the block
-        self.mempool = [(tx, sign) for (tx, sign) in self.mempool if tx.to_dict() not in block_transactions]
+        self.mempool.remove_confirmed(block.transactions)
+        if revalidate:
+            self.revalidate_mempool()
         
         print("Block added.")
 
-    def update_balances(self, transaction: Transaction):
+    def revalidate_mempool(self):
+        """
+            Drops the mempool transactions that no longer pass
+            check_transaction() on the current tip, e.g. one that lost a
+            double spend to a block. They could never be mined, but would
+            keep counting in get_effective_balance(). Transactions are taken
+            in arrival order, and the ones failing are checked again after
+            the others as long as some pass, since a gossiped child can
+            arrive before the parent paying it.
+        """
+        delta = {}
+        seen = set()
+        pending = list(self.mempool)
+        while True:
+            failed = []
+            for tx, sign in pending:
+                error = self.check_transaction(tx, sign, delta, seen)
+                if error is not None:
+                    failed.append((tx, sign, error))
+            if not failed or len(failed) == len(pending):
+                break
+            pending = [(tx, sign) for tx, sign, _ in failed]
+        for tx, _, error in failed:
+            print(f"[revalidate_mempool] dropping {error}")
+            self.mempool.remove(tx.txid)
+
+    def connect_block(self, block: Block, height: int):
+        """
+            Applies a block at the tip to balances, keeping its undo record,
+            and indexes it. Only the first transaction is the mining reward,
+            whatever the others' payers are named.
+        """
+        undo = {}
+        for index, tx in enumerate(block.transactions):
+            self.update_balances(tx, undo, reward=index == 0)
+        self.undo_records[block.hash] = undo
+        self.index_block(block, height)
+        self.tip_hash = block.hash
+
+    def disconnect_block(self) -> Block:
+        """
+            Removes the tip of the chain and reverses its balance changes
+            using the block's undo record. Returns the removed block.
+        """
+        block = self.chain.pop()
+        self.tip_hash = block.prev_hash
+        undo = self.undo_records.pop(block.hash)
+        for public_key, (delta, created) in undo.items():
+            balance = self.balances.get(public_key, 0) - delta
+            if created and balance == 0:
+                self.balances.pop(public_key, None)
+            else:
+                self.balances[public_key] = balance
+        del self.block_heights[block.hash]
+        for tx in block.transactions:
+            self.tx_index.pop(tx.txid, None)
+        # the tree may only hold the header of a block loaded from the store,
+        # keep the full block now that it sits on a side branch
+        self.tree.get(block.hash).block = block
+        return block
+
+    def index_block(self, block: Block, height: int):
+        """
+            Records a block in block_heights and its txids in tx_index.
+        """
+        self.block_heights[block.hash] = height
+        for tx in block.transactions:
+            self.tx_index[tx.txid] = height
+
+    def locator(self) -> list:
+        """
+            A sparse list of block hashes from the tip back to genesis: the
+            last 10 blocks one by one, then doubling the step each time. Sent
+            to peers so they can find where our chains split with a handful
+            of hashes whatever the chain length.
+        """
+        hashes = []
+        height = len(self.chain) - 1
+        step = 1
+        while height > 0:
+            hashes.append(self.hash_at(height))
+            if len(hashes) >= 10:
+                step *= 2
+            height -= step
+        hashes.append(self.hash_at(0))
+        return hashes
+
+    def hash_at(self, height: int) -> str:
+        """
+            Hash of the block at a height of the active chain. With a store
+            it comes from the height index, without decoding the block.
+        """
+        if isinstance(self.chain, StoredChain):
+            return self.chain.store.hash_at(height)
+        return self.chain[height].hash
+
+    def fork_point(self, locator: list) -> int:
+        """
+            Height of the first hash in a peer's locator that is also on our
+            chain, i.e. the last block both chains share.
+        """
+        for block_hash in locator:
+            height = self.block_heights.get(block_hash)
+            if height is not None:
+                return height
+        return 0
+
+    def headers_after(self, height: int, limit: int) -> list:
+        """
+            Headers of up to limit blocks following the given height. With a
+            store they come from its header index, no block is decoded.
+        """
+        if isinstance(self.chain, StoredChain):
+            store = self.chain.store
+            return [store.header_at(h) for h in range(height + 1, min(height + 1 + limit, len(store)))]
+        return [block.header() for block in self.chain[height + 1:height + 1 + limit]]
+
+    def get_block(self, block_hash: str) -> Block:
+        """
+            A known block with its transactions, from any branch, or None.
+        """
+        entry = self.tree.get(block_hash)
+        if entry is not None and isinstance(entry.block, Block):
+            return entry.block
+        # blocks loaded from the store only have their header in the tree
+        height = self.block_heights.get(block_hash)
+        return self.chain[height] if height is not None else None
+
+    def blocks_by_hash(self, hashes: list, max_bytes: int = None) -> list:
+        """
+            The blocks on our chain with the given hashes, skipping unknown
+            ones. With max_bytes, stops before the block that would take the
+            transactions past it (but returns at least one), so blocks that
+            won't be sent are never read from the store.
+        """
+        blocks = []
+        size = 0
+        for block_hash in hashes:
+            height = self.block_heights.get(block_hash)
+            if height is None:
+                continue
+            block = self.chain[height]
+            size += block_size(block)
+            if blocks and max_bytes is not None and size > max_bytes:
+                break
+            blocks.append(block)
+        return blocks
+
+    def check_headers(self, fork_height: int, headers: list) -> bool:
+        """
+            Checks that headers link to each other and to our block at
+            fork_height, and that every one uses the expected target, is dated
+            after its parent and has a valid proof of work for it.
+        """
+        if fork_height >= len(self.chain):
+            return False
+        parent = self.chain[fork_height]
+        pending = {}
+        for height, header in enumerate(headers, fork_height + 1):
+            if (header.prev_hash != parent.hash
+                    or header.target != self.target_after(parent, height - 1, pending)
+                    or header.timestamp <= parent.timestamp
+                    or not meets_target(header.hash, header.target)):
+                return False
+            pending[header.hash] = header
+            parent = header
+        return True
+
+    def reorganize(self, fork_height: int, blocks: list):
+        """
+            Switches to another branch: disconnects our blocks after fork_height
+            and appends the given ones. Pending transactions the new branch
+            commited leave the mempool. Costs the depth of the reorg, not the
+            length of the chain.
+
+            Every new block must pass check_transitions() on top of the one
+            before it. If one doesn't, it and its descendants are dropped from
+            the block tree, the blocks connected so far are disconnected and
+            the old branch is put back. Returns whether the switch happened.
+            Either way, transactions of disconnected blocks that the active
+            chain lacks go back to the mempool, and revalidate_mempool()
+            drops whatever no longer fits the new tip.
+        """
+        if not self.verify_blocks(blocks):
+            print("[reorganize] branch has an invalid signature")
+            for block in blocks:
+                if not self.verify_blocks([block]):
+                    self.tree.discard(block.hash)
+                    break
+            return False
+
+        disconnected = []
+        while len(self.chain) - 1 > fork_height:
+            disconnected.append(self.disconnect_block())
+        for connected, block in enumerate(blocks):
+            error = self.check_transitions(block)
+            if error is not None:
+                print(f"[reorganize] block {block.hash[:8]} rejected: {error}")
+                self.tree.discard(block.hash)
+                rolled_back = [self.disconnect_block() for _ in range(connected)]
+                for old in reversed(disconnected):
+                    self.add_block(old, revalidate=False)
+                # add_block took them out of the mempool, but they're pending again
+                self.return_to_mempool(rolled_back[::-1])
+                self.revalidate_mempool()
+                return False
+            self.add_block(block, revalidate=False)
+
+        # what the old branch commited and the new one didn't is pending again
+        self.return_to_mempool(disconnected[::-1])
+        self.revalidate_mempool()
+        return True
+
+    def return_to_mempool(self, blocks: list):
+        """
+            Puts the transactions of disconnected blocks (oldest first) that
+            the active chain doesn't hold back into the mempool and the
+            template. They go ahead of the pending transactions, in block
+            order, so revalidate_mempool() sees a parent before a pending
+            child spending what it paid.
+        """
+        returned = [(tx, sign) for block in blocks
+                    for tx, sign in zip(block.transactions[1:], block.signatures[1:])
+                    if sign is not None and tx.txid not in self.tx_index]
+        for tx, sign in self.mempool.restore(returned):
+            self.template.add(tx, sign)
+
+    def has_transaction(self, txid: str) -> bool:
+        """
+            Whether a transaction is in the mempool or already on the chain.
+        """
+        return txid in self.mempool or txid in self.tx_index
+
+    def get_transaction(self, txid: str):
+        """
+            Looks up a transaction by txid. Returns (tx, height of its block),
+            with height None for a transaction still in the mempool, or None
+            if the transaction is unknown.
+        """
+        entry = self.mempool.get(txid)
+        if entry is not None:
+            return entry[0], None
+        height = self.tx_index.get(txid)
+        if height is None:
+            return None
+        for tx in self.chain[height].transactions:
+            if tx.txid == txid:
+                return tx, height
+        return None
+
+    def update_balances(self, transaction: Transaction, undo: dict = None, reward: bool = False):
         """
             Updates the balance dictionary for affected Wallets.
             Also responsible for adding new users to balances.
+            If undo is given, the change to every address is added to it as
+            {public_key: (total delta, whether the address was new)}.
+            reward: the transaction is a block's mining reward (or the
+                    genesis grant), which only credits its payee
         """
         payer = transaction.payer
         payee_public_key = transaction.payee_public_key
         amount = transaction.amount
         
         # Don't care about coinbase's balance. Effectively infinite.
-        if payer.name != "coinbase":
-            if payer.public_key not in self.balances:
-                self.balances[payer.public_key] = 0
-            self.balances[payer.public_key] -= amount
-        
-        if payee_public_key not in self.balances:
-            self.balances[payee_public_key] = 0
-        self.balances[payee_public_key] += amount
+        if not reward:
+            self._credit(payer.public_key, -amount, undo)
+        self._credit(payee_public_key, amount, undo)
+
+    def _credit(self, public_key: str, amount: float, undo: dict):
+        if undo is not None:
+            delta, created = undo.get(public_key, (0, public_key not in self.balances))
+            undo[public_key] = (delta + amount, created)
+        if public_key not in self.balances:
+            self.balances[public_key] = 0
+        self.balances[public_key] += amount
 
     def get_balance(self, payer: Wallet) -> float: # balance without mempool
         """
@@ -151,13 +897,7 @@ class Chain:
             Mainly to prevent double spending and spamming transactions before
             the next block has been created.
         """
-        balance = self.get_balance(payer)
-        for tx, _ in self.mempool:
-            if tx.payer and tx.payer.public_key == payer.public_key:
-                balance -= tx.amount
-            elif tx.payee_public_key == payer.public_key:
-                balance += tx.amount
-        return balance
+        return self.get_balance(payer) + self.mempool.pending_delta(payer.public_key)
 
     def print_balances(self):
         """
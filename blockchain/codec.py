@@ -0,0 +1,228 @@
+# Compact binary encoding of transactions, blocks and chain segments for the
+# wire. Only what consensus needs is carried: a payer travels as its public
+# key, never as a pickled Wallet.
+import base64
+import struct
+from blockchain.transaction import Transaction, pack_key, unpack_key
+from blockchain.block import Block, BlockHeader
+
+CODEC_VERSION = 4
+_DOUBLE = struct.Struct(">d")
+
+def write_varint(value: int) -> bytes:
+    """
+        LEB128 encoding of a non-negative int.
+    """
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def read_varint(data: bytes, offset: int):
+    """
+        Reverses write_varint. Returns the value and the offset after it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+def write_bytes(value: bytes) -> bytes:
+    return write_varint(len(value)) + value
+
+def read_bytes(data: bytes, offset: int):
+    length, offset = read_varint(data, offset)
+    value = data[offset:offset + length]
+    if len(value) != length:
+        raise ValueError("truncated field")
+    return value, offset + length
+
+def write_signature(sign: str) -> bytes:
+    """
+        Signatures are base64 strings in memory, raw bytes on the wire.
+    """
+    return write_bytes(base64.b64decode(sign))
+
+def read_signature(data: bytes, offset: int):
+    raw, offset = read_bytes(data, offset)
+    return base64.b64encode(raw).decode(), offset
+
+def read_target(data: bytes, offset: int):
+    """
+        A proof of work target, stored as a 32-byte big-endian integer.
+    """
+    raw = data[offset:offset + 32]
+    if len(raw) != 32:
+        raise ValueError("truncated field")
+    return int.from_bytes(raw, "big"), offset + 32
+
+def encode_transaction(transaction: Transaction, sign: str) -> bytes:
+    """
+        A transaction with its signature.
+    """
+    return transaction.serialize() + write_signature(sign)
+
+def decode_transaction(data: bytes, offset: int = 0):
+    """
+        Returns (transaction, signature) and the offset after them.
+    """
+    transaction, offset = Transaction.deserialize(data, offset)
+    sign, offset = read_signature(data, offset)
+    return (transaction, sign), offset
+
+def encode_block(block: Block) -> bytes:
+    """
+        Header fields and transactions of a block, each followed by its
+        signature (empty for the mining reward). The merkle root isn't sent,
+        the receiver rebuilds it from the transactions.
+    """
+    parts = [pack_key(str(block.prev_hash)), _DOUBLE.pack(block.timestamp),
+             block.target.to_bytes(32, "big"), write_varint(block.nonce),
+             write_varint(len(block.transactions))]
+    for tx, sign in zip(block.transactions, block.signatures):
+        parts.append(tx.serialize())
+        parts.append(write_signature(sign) if sign is not None else write_varint(0))
+    return b"".join(parts)
+
+def decode_block(data: bytes, offset: int = 0):
+    """
+        Returns the block and the offset after it.
+    """
+    prev_hash, offset = unpack_key(data, offset)
+    timestamp, = _DOUBLE.unpack_from(data, offset)
+    target, offset = read_target(data, offset + _DOUBLE.size)
+    nonce, offset = read_varint(data, offset)
+    count, offset = read_varint(data, offset)
+    transactions = []
+    signatures = []
+    for _ in range(count):
+        tx, offset = Transaction.deserialize(data, offset)
+        sign, offset = read_signature(data, offset)
+        transactions.append(tx)
+        signatures.append(sign or None)
+    block = Block(prev_hash, transactions, nonce, signatures=signatures, target=target)
+    block.timestamp = timestamp
+    return block, offset
+
+def encode_header(header: BlockHeader) -> bytes:
+    """
+        A block header: previous hash, merkle root, timestamp, target and nonce.
+    """
+    return (pack_key(str(header.prev_hash)) + pack_key(header.merkle_root)
+            + _DOUBLE.pack(header.timestamp) + header.target.to_bytes(32, "big")
+            + write_varint(header.nonce))
+
+def decode_header(data: bytes, offset: int = 0):
+    prev_hash, offset = unpack_key(data, offset)
+    merkle_root, offset = unpack_key(data, offset)
+    timestamp, = _DOUBLE.unpack_from(data, offset)
+    target, offset = read_target(data, offset + _DOUBLE.size)
+    nonce, offset = read_varint(data, offset)
+    return BlockHeader(prev_hash, merkle_root, timestamp, nonce, target), offset
+
+def encode_headers(headers: list) -> bytes:
+    return write_varint(len(headers)) + b"".join(encode_header(header) for header in headers)
+
+def decode_headers(data: bytes, offset: int = 0):
+    count, offset = read_varint(data, offset)
+    headers = []
+    for _ in range(count):
+        header, offset = decode_header(data, offset)
+        headers.append(header)
+    return headers, offset
+
+def encode_hashes(hashes: list) -> bytes:
+    """
+        A list of block hashes (or txids).
+    """
+    return write_varint(len(hashes)) + b"".join(pack_key(h) for h in hashes)
+
+def decode_hashes(data: bytes, offset: int = 0):
+    count, offset = read_varint(data, offset)
+    hashes = []
+    for _ in range(count):
+        h, offset = unpack_key(data, offset)
+        hashes.append(h)
+    return hashes, offset
+
+_INVENTORY_KINDS = {"tx": 1, "block": 2}
+_INVENTORY_NAMES = {code: kind for kind, code in _INVENTORY_KINDS.items()}
+
+def encode_inventory(items: list) -> bytes:
+    """
+        (kind, hash) pairs announced or requested, kind being "tx" or "block".
+    """
+    parts = [write_varint(len(items))]
+    for kind, item_hash in items:
+        parts.append(bytes([_INVENTORY_KINDS[kind]]) + bytes.fromhex(item_hash))
+    return b"".join(parts)
+
+def decode_inventory(data: bytes, offset: int = 0):
+    count, offset = read_varint(data, offset)
+    items = []
+    for _ in range(count):
+        kind = _INVENTORY_NAMES.get(data[offset])
+        item_hash = data[offset + 1:offset + 33]
+        if kind is None or len(item_hash) != 32:
+            raise ValueError("bad inventory item")
+        items.append((kind, item_hash.hex()))
+        offset += 33
+    return items, offset
+
+def encode_addresses(entries: list) -> bytes:
+    """
+        Peer exchange entries: (listen address, public key, name) of peers.
+    """
+    parts = [write_varint(len(entries))]
+    for address, public_key, name in entries:
+        parts.append(write_bytes(address.encode()) + pack_key(public_key) + write_bytes(name.encode()))
+    return b"".join(parts)
+
+def decode_addresses(data: bytes, offset: int = 0):
+    count, offset = read_varint(data, offset)
+    entries = []
+    for _ in range(count):
+        address, offset = read_bytes(data, offset)
+        public_key, offset = unpack_key(data, offset)
+        name, offset = read_bytes(data, offset)
+        entries.append((address.decode(), public_key, name.decode()))
+    return entries, offset
+
+def encode_blocks(blocks: list) -> bytes:
+    """
+        A chain segment: a count, then the blocks in order.
+    """
+    return write_varint(len(blocks)) + b"".join(encode_block(block) for block in blocks)
+
+def decode_blocks(data: bytes, offset: int = 0):
+    count, offset = read_varint(data, offset)
+    blocks = []
+    for _ in range(count):
+        block, offset = decode_block(data, offset)
+        blocks.append(block)
+    return blocks, offset
+
+def encode_balances(balances: dict) -> bytes:
+    parts = [write_varint(len(balances))]
+    for public_key, balance in balances.items():
+        parts.append(pack_key(public_key) + _DOUBLE.pack(balance))
+    return b"".join(parts)
+
+def decode_balances(data: bytes, offset: int = 0):
+    count, offset = read_varint(data, offset)
+    balances = {}
+    for _ in range(count):
+        public_key, offset = unpack_key(data, offset)
+        balances[public_key], = _DOUBLE.unpack_from(data, offset)
+        offset += _DOUBLE.size
+    return balances, offset
@@ -0,0 +1,114 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from blockchain.transaction import Transaction
+
+class Mempool:
+    """
+        Transactions not commited to the blockchain yet, indexed by txid. Also keeps running totals of what every address is
+        about to pay and receive, so effective balances don't need a scan.
+    """
+    def __init__(self):
+        """
+            _entries: dict[txid, (tx, signature)], in arrival order
+            _debits: dict[public key, pending amount sent]
+            _credits: dict[public key, pending amount received]
+            _counts: dict[public key, number of pending transactions involving it]
+        """
+        self._entries = {}
+        self._debits = {}
+        self._credits = {}
+        self._counts = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        """
+            Yields (tx, signature) pairs in the order they were added.
+        """
+        return iter(list(self._entries.values()))
+
+    def __contains__(self, txid: str):
+        return txid in self._entries
+
+    def get(self, txid: str):
+        """
+            Returns the (tx, signature) pair of a txid, or None.
+        """
+        return self._entries.get(txid)
+
+    def add(self, transaction: Transaction, sign: str) -> bool:
+        """
+            Adds a transaction. Returns False if it is already in the mempool.
+        """
+        if transaction.txid in self._entries:
+            return False
+        self._entries[transaction.txid] = (transaction, sign)
+        self._track(transaction, 1)
+        return True
+
+    def restore(self, entries: list) -> list:
+        """
+            Puts back (tx, signature) pairs of disconnected blocks, oldest
+            first, ahead of the pending transactions, which may spend what
+            they pay. Ones already in the mempool are skipped. Returns the
+            pairs added.
+        """
+        pending = self._entries
+        self._entries = {}
+        added = []
+        for transaction, sign in entries:
+            if transaction.txid in self._entries or transaction.txid in pending:
+                continue
+            self._entries[transaction.txid] = (transaction, sign)
+            self._track(transaction, 1)
+            added.append((transaction, sign))
+        self._entries.update(pending)
+        return added
+
+    def remove(self, txid: str):
+        """
+            Removes a transaction by txid and returns its (tx, signature) pair,
+            or None if it isn't in the mempool.
+        """
+        entry = self._entries.pop(txid, None)
+        if entry is not None:
+            self._track(entry[0], -1)
+        return entry
+
+    def remove_confirmed(self, transactions: list):
+        """
+            Removes every transaction that was commited in a block.
+        """
+        for tx in transactions:
+            self.remove(tx.txid)
+
+    def pending_delta(self, public_key: str) -> float:
+        """
+            How much the pending transactions change an address's balance.
+        """
+        return self._credits.get(public_key, 0) - self._debits.get(public_key, 0)
+
+    def _track(self, transaction: Transaction, sign: int):
+        """
+            Adds (sign=1) or removes (sign=-1) a transaction from the running
+            totals. A payment to oneself only counts as a debit.
+        """
+        payer = transaction.payer.public_key if transaction.payer else None
+        payee = transaction.payee_public_key
+        if payer is not None:
+            self._adjust(self._debits, payer, sign * transaction.amount, sign)
+        if payee != payer:
+            self._adjust(self._credits, payee, sign * transaction.amount, sign)
+
+    def _adjust(self, totals: dict, public_key: str, amount: float, count: int):
+        self._counts[public_key] = self._counts.get(public_key, 0) + count
+        if self._counts[public_key] == 0:
+            # drop the address instead of keeping float rounding leftovers
+            del self._counts[public_key]
+            self._debits.pop(public_key, None)
+            self._credits.pop(public_key, None)
+        else:
+            totals[public_key] = totals.get(public_key, 0) + amount
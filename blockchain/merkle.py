@@ -0,0 +1,60 @@
+import hashlib
+
+EMPTY_ROOT = "0" * 64 # root of a block without transactions
+
+def hash_pair(left: str, right: str) -> str:
+    """
+        Hashes two hex child hashes into their parent hash.
+    """
+    return hashlib.sha256(bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+class MerkleTree:
+    """
+        Merkle tree over a list of hex leaf hashes (the transaction hashes of
+        a block). Every level is kept so inclusion proofs don't need to
+        rehash anything. Like Bitcoin, an odd node out is paired with itself,
+        so [a, b, c] and [a, b, c, c] have the same root: blocks with a
+        repeated txid are rejected by Chain.check_block.
+    """
+    def __init__(self, leaves: list):
+        """
+            leaves: hex hashes of the transactions, in block order
+            levels: levels[0] are the leaves, levels[-1] holds only the root
+        """
+        self.levels = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            if len(level) % 2 == 1:
+                level = level + [level[-1]]
+            self.levels.append([hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)])
+
+    @property
+    def root(self) -> str:
+        """
+            The merkle root, committed to in the block header.
+        """
+        if not self.levels[0]:
+            return EMPTY_ROOT
+        return self.levels[-1][0]
+
+    def proof(self, index: int) -> list:
+        """
+            Returns the inclusion proof of the leaf at index as a list of
+            (sibling hash, sibling is on the left) pairs from leaf to root.
+        """
+        path = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            sibling_hash = level[sibling] if sibling < len(level) else level[index]
+            path.append((sibling_hash, sibling < index))
+            index //= 2
+        return path
+
+def verify_proof(leaf: str, proof: list, root: str) -> bool:
+    """
+        Checks that leaf is included under root using a proof from MerkleTree.proof.
+    """
+    current = leaf
+    for sibling, sibling_is_left in proof:
+        current = hash_pair(sibling, current) if sibling_is_left else hash_pair(current, sibling)
+    return current == root
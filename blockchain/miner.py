@@ -0,0 +1,204 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+
+# Proof of work target: a block is valid when its hash, read as a 256-bit
+# integer, is below the target stored in its header. The first blocks need 4
+# leading hex 0s, after that retarget() follows the observed block times.
+INITIAL_TARGET = 16 ** (64 - 4)
+MAX_TARGET = 16 ** (64 - 3) # easiest target a block may use
+BLOCK_INTERVAL = 15.0 # seconds the network aims for between blocks
+RETARGET_INTERVAL = 10 # blocks between target adjustments
+MAX_ADJUSTMENT = 4 # most the target moves in one adjustment, either way
+
+def hash_header(header_prefix: bytes, nonce: int) -> str:
+    """
+        Hashes a serialized block header with the nonce appended.
+    """
+    return hashlib.sha256(header_prefix + str(nonce).encode()).hexdigest()
+
+def meets_target(block_hash: str, target: int) -> bool:
+    """
+        Checks a hex block hash against a proof of work target.
+    """
+    return int(block_hash, 16) < target
+
+def retarget(target: int, timespan: float, blocks: int) -> int:
+    """
+        The target for the next blocks, given that the last ones took
+        timespan seconds for blocks intervals. Slow blocks make the target
+        bigger (easier), fast ones smaller, by at most MAX_ADJUSTMENT.
+    """
+    # whole milliseconds, so every node computes the exact same integer
+    expected = int(BLOCK_INTERVAL * blocks * 1000)
+    timespan = min(max(int(timespan * 1000), expected // MAX_ADJUSTMENT), expected * MAX_ADJUSTMENT)
+    return max(1, min(MAX_TARGET, target * timespan // expected))
+
+class Miner:
+    """
+        Proof of work search over a block header. The header (everything but
+        the nonce) is fed into a sha256 state once, and every attempt only
+        copies that midstate and feeds the nonce.
+    """
+    def __init__(self, check_interval: int = 4096):
+        """
+            check_interval: how many nonces to try between calls to should_stop
+            hashes: number of hashes tried in the last search
+            hashrate: hashes per second of the last search
+            worker_hashrates: hashrate of each worker in the last search
+        """
+        self.check_interval = check_interval
+        self.hashes = 0
+        self.hashrate = 0.0
+        self.worker_hashrates = []
+        self._cancel = threading.Event()
+
+    def reset(self):
+        """
+            Re-arms the miner for the next search. Called when the block to
+            search is prepared, not by search() itself, so a cancel() that
+            arrives in between isn't lost.
+        """
+        self._cancel.clear()
+
+    def cancel(self):
+        """
+            Stops the running search, or the next one if it hasn't started
+            yet. Safe to call from any thread.
+        """
+        self._cancel.set()
+
+    def search(self, header_prefix: bytes, target: int, start: int = 0, stop: int = None,
+               step: int = 1, should_stop=None):
+        """
+            Tries nonces start, start + step, ... (up to stop) and returns the
+            first one whose hash is below target. Returns None if should_stop()
+            returns True, cancel() is called or the range runs out.
+        """
+        cancelled = self._cancel.is_set
+        midstate = hashlib.sha256(header_prefix)
+        # compared to raw digests, so no hex formatting or int parsing per try
+        target = target.to_bytes(32, "big")
+        interval = self.check_interval
+        nonce = start
+        tried = 0
+        started = time.perf_counter()
+        try:
+            while stop is None or nonce < stop:
+                if tried % interval == 0 and (cancelled() or
+                                              (should_stop is not None and should_stop())):
+                    return None
+                h = midstate.copy()
+                h.update(str(nonce).encode())
+                tried += 1
+                if h.digest() < target:
+                    return nonce
+                nonce += step
+            return None
+        finally:
+            elapsed = time.perf_counter() - started
+            self.hashes = tried
+            self.hashrate = tried / elapsed if elapsed > 0 else 0.0
+            self.worker_hashrates = [self.hashrate]
+
+_worker_cancel = None # cancellation event shared by all ParallelMiner workers
+
+def _init_worker(cancel):
+    """
+        Runs once in each pool process to keep a handle on the shared event.
+    """
+    global _worker_cancel
+    _worker_cancel = cancel
+
+def _search_slice(header_prefix: bytes, target: int, start: int, step: int, check_interval: int):
+    """
+        Searches one worker's slice of the nonce space. The first worker to
+        find a nonce sets the shared event so the others stop too.
+    """
+    miner = Miner(check_interval)
+    nonce = miner.search(header_prefix, target, start=start, step=step,
+                         should_stop=_worker_cancel.is_set)
+    if nonce is not None:
+        _worker_cancel.set()
+    return nonce, miner.hashes, miner.hashrate
+
+class ParallelMiner:
+    """
+        Splits the nonce space of a block across a pool of processes. Worker i
+        tries nonces i, i + workers, i + 2 * workers, ... so no two workers
+        repeat work. All workers watch one shared event, which is set by
+        whichever worker wins, by cancel(), or when should_stop() fires.
+    """
+    def __init__(self, workers: int = None, check_interval: int = 1024):
+        """
+            workers: number of processes, defaults to one per core
+            check_interval: how many nonces a worker tries between checks of
+                            the cancellation event
+            hashes, hashrate, worker_hashrates: stats of the last search
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.check_interval = check_interval
+        self.hashes = 0
+        self.hashrate = 0.0
+        self.worker_hashrates = []
+        # spawn rather than fork since peers fork from a process full of threads
+        self._context = multiprocessing.get_context("spawn")
+        self._cancel = self._context.Event()
+        self._pool = None
+
+    def _get_pool(self):
+        """
+            Starts the worker processes on first use and keeps them around.
+        """
+        if self._pool is None:
+            self._pool = self._context.Pool(self.workers, initializer=_init_worker,
+                                            initargs=(self._cancel,))
+        return self._pool
+
+    def reset(self):
+        """
+            Re-arms the miner for the next search, see Miner.reset().
+        """
+        self._cancel.clear()
+
+    def cancel(self):
+        """
+            Stops every worker of the running search, or the next search if
+            it hasn't started yet. Safe to call from any thread.
+        """
+        self._cancel.set()
+
+    def search(self, header_prefix: bytes, target: int, should_stop=None, poll_interval: float = 0.005):
+        """
+            Returns a nonce whose hash is below target, or None if the search
+            was cancelled. should_stop() is polled every poll_interval seconds
+            while the workers run.
+        """
+        pool = self._get_pool()
+        results = [pool.apply_async(_search_slice, (header_prefix, target, i, self.workers, self.check_interval))
+                   for i in range(self.workers)]
+        while not all(result.ready() for result in results):
+            if should_stop is not None and should_stop():
+                self._cancel.set()
+            results[0].wait(poll_interval)
+
+        found = [result.get() for result in results]
+
+        # from the workers' own timings, pool start-up and polling aren't hashing
+        self.worker_hashrates = [hashrate for _, _, hashrate in found]
+        self.hashes = sum(hashes for _, hashes, _ in found)
+        self.hashrate = sum(self.worker_hashrates)
+        if should_stop is not None and should_stop():
+            return None
+        nonces = [nonce for nonce, _, _ in found if nonce is not None]
+        return min(nonces) if nonces else None
+
+    def close(self):
+        """
+            Shuts down the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import struct
+from blockchain import codec
+
+_SNAPSHOT_HEADER = struct.Struct(">4sIQ32s") # magic, version, height, block hash
+_SNAPSHOT_MAGIC = b"SNAP"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_SUFFIX = ".snap"
+
+class Snapshot:
+    """
+        The chain state right after the block at some height: balances and
+        which block every transaction was commited in. A node restarting
+        from one only replays the blocks stored after it.
+    """
+    def __init__(self, height: int, block_hash: str, work: int, balances: dict, tx_index: dict):
+        """
+            height, block_hash: the last block applied to this state
+            work: cumulative work of the chain up to that block
+            balances: copy of Chain.balances
+            tx_index: copy of Chain.tx_index
+        """
+        self.height = height
+        self.block_hash = block_hash
+        self.work = work
+        self.balances = balances
+        self.tx_index = tx_index
+
+    def encode(self) -> bytes:
+        """
+            Header, state, then a sha256 of everything before it so a torn
+            or corrupted file is never loaded.
+        """
+        parts = [_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, self.height,
+                                       bytes.fromhex(self.block_hash)),
+                 codec.write_bytes(self.work.to_bytes((self.work.bit_length() + 7) // 8, "big")),
+                 codec.encode_balances(self.balances),
+                 codec.write_varint(len(self.tx_index))]
+        for txid, height in self.tx_index.items():
+            parts.append(bytes.fromhex(txid) + codec.write_varint(height))
+        data = b"".join(parts)
+        return data + hashlib.sha256(data).digest()
+
+    @classmethod
+    def decode(cls, data: bytes):
+        """
+            Reverses encode. Raises ValueError if the file isn't a valid snapshot.
+        """
+        body, checksum = data[:-32], data[-32:]
+        if len(body) < _SNAPSHOT_HEADER.size or hashlib.sha256(body).digest() != checksum:
+            raise ValueError("bad snapshot checksum")
+        magic, version, height, block_hash = _SNAPSHOT_HEADER.unpack_from(body, 0)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+            raise ValueError("not a snapshot")
+        offset = _SNAPSHOT_HEADER.size
+        work, offset = codec.read_bytes(body, offset)
+        balances, offset = codec.decode_balances(body, offset)
+        count, offset = codec.read_varint(body, offset)
+        tx_index = {}
+        for _ in range(count):
+            txid = body[offset:offset + 32].hex()
+            tx_index[txid], offset = codec.read_varint(body, offset + 32)
+        return cls(height, block_hash.hex(), int.from_bytes(work, "big"), balances, tx_index)
+
+    def save(self, directory: str, keep: int = 2):
+        """
+            Writes the snapshot atomically: to a temporary file that is
+            fsynced and then renamed over <height>.snap. Only the newest
+            keep snapshots are left in directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.height:012d}{_SNAPSHOT_SUFFIX}")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd) # make the rename itself durable
+        finally:
+            os.close(dir_fd)
+
+        for old in snapshot_files(directory)[keep:]:
+            os.remove(old)
+
+def snapshot_files(directory: str) -> list:
+    """
+        Snapshot paths in directory, newest first.
+    """
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory) if name.endswith(_SNAPSHOT_SUFFIX)), reverse=True)
+    return [os.path.join(directory, name) for name in names]
+
+def latest_snapshot(directory: str, store) -> Snapshot:
+    """
+        The newest snapshot in directory that is intact and whose block is
+        still at its height in store, or None. Snapshots of blocks that a
+        reorg has since disconnected are skipped.
+    """
+    for path in snapshot_files(directory):
+        try:
+            with open(path, "rb") as f:
+                snapshot = Snapshot.decode(f.read())
+        except (OSError, ValueError, IndexError) as e:
+            print(f"[latest_snapshot] skipping {path}: {e}")
+            continue
+        if snapshot.height < len(store) and store.hash_at(snapshot.height) == snapshot.block_hash:
+            return snapshot
+    return None
@@ -0,0 +1,400 @@
+import mmap
+import os
+import struct
+import time
+from blockchain import codec
+from blockchain.block import BlockHeader
+from blockchain.cache import LRUCache
+
+_INDEX_HEADER = struct.Struct(">4sIQ") # magic, version, number of blocks
+_INDEX_RECORD = struct.Struct(">QI32s") # offset in blocks.dat, length, block hash
+_INDEX_MAGIC = b"BIDX"
+_INDEX_VERSION = 1
+_HASH_HEADER = struct.Struct(">4sIQQQ") # magic, version, slots, used slots, heights indexed
+_HASH_SLOT = struct.Struct(">32sQ") # block hash, height + 1 (0 for an empty slot)
+_HASH_MAGIC = b"HIDX"
+_HASH_VERSION = 1
+_HEADERS_HEADER = struct.Struct(">4sIQ") # magic, version, heights indexed
+_HEADER_RECORD = struct.Struct(">32s32sd32sQ") # prev hash, merkle root, timestamp, target, nonce
+_HEADERS_MAGIC = b"HDRS"
+_HEADERS_VERSION = 1
+
+class HashIndex:
+    """
+        hashes.idx: a memory-mapped open-addressing table from block hash to
+        height, so opening a store doesn't scan every record. A hash's slot
+        is found by linear probing from its last 8 bytes (the first ones are
+        the proof of work zeros). Entries are never removed: a truncated
+        height can leave a stale slot behind, which BlockStore.height_of
+        rejects by comparing with heights.idx. The table doubles once it is
+        half full.
+    """
+    def __init__(self, path: str, slots: int = 4096):
+        """
+            slots: size of a new table, a power of two
+            indexed: heights below this are all in the table, as of the last
+                     flush()
+        """
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        if os.fstat(self._fd).st_size < _HASH_HEADER.size:
+            os.ftruncate(self._fd, _HASH_HEADER.size + slots * _HASH_SLOT.size)
+            os.pwrite(self._fd, _HASH_HEADER.pack(_HASH_MAGIC, _HASH_VERSION, slots, 0, 0), 0)
+        self._map = mmap.mmap(self._fd, 0)
+        magic, version, self._slots, self._used, self.indexed = _HASH_HEADER.unpack_from(self._map, 0)
+        if magic != _HASH_MAGIC or version != _HASH_VERSION:
+            raise ValueError(f"{path} is not a block hash index")
+
+    def _probe(self, raw: bytes):
+        """
+            Offset of raw's slot, or of the empty slot where it would go.
+        """
+        slot = int.from_bytes(raw[-8:], "big") & (self._slots - 1)
+        while True:
+            position = _HASH_HEADER.size + slot * _HASH_SLOT.size
+            stored, value = _HASH_SLOT.unpack_from(self._map, position)
+            if value == 0 or stored == raw:
+                return position, value
+            slot = (slot + 1) & (self._slots - 1)
+
+    def get(self, raw: bytes) -> int:
+        """
+            The height last recorded for a 32-byte hash, or None.
+        """
+        _, value = self._probe(raw)
+        return value - 1 if value else None
+
+    def put(self, raw: bytes, height: int):
+        position, value = self._probe(raw)
+        _HASH_SLOT.pack_into(self._map, position, raw, height + 1)
+        if not value:
+            self._used += 1
+            if 2 * self._used > self._slots:
+                self._grow()
+
+    def _grow(self):
+        """
+            Doubles the table and reinserts every entry.
+        """
+        entries = []
+        for slot in range(self._slots):
+            raw, value = _HASH_SLOT.unpack_from(self._map, _HASH_HEADER.size + slot * _HASH_SLOT.size)
+            if value:
+                entries.append((raw, value - 1))
+        self._slots *= 2
+        self._map.resize(_HASH_HEADER.size + self._slots * _HASH_SLOT.size)
+        self._map[_HASH_HEADER.size:] = bytes(self._slots * _HASH_SLOT.size)
+        self._used = 0
+        for raw, height in entries:
+            self.put(raw, height)
+        # the header has to describe the new layout before any of it reaches
+        # the disk; if a crash cuts this short, the next open reinserts all
+        self.indexed = 0
+        self._write_header()
+
+    def _write_header(self):
+        _HASH_HEADER.pack_into(self._map, 0, _HASH_MAGIC, _HASH_VERSION, self._slots, self._used, self.indexed)
+
+    def flush(self, indexed: int):
+        """
+            Writes the slots back, then records that heights below indexed
+            are in them, so a crash can only make the next open reinsert some.
+        """
+        self._map.flush()
+        self.indexed = indexed
+        self._write_header()
+        self._map.flush(0, mmap.PAGESIZE)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+class HeaderIndex:
+    """
+        headers.idx: a memory-mapped table with the header of the block at
+        every height in a fixed-size record, so headers are served without
+        decoding block bodies and rebuilding their merkle trees. Records past
+        the store's height are stale and never read, see BlockStore.header_at.
+    """
+    def __init__(self, path: str, slots: int = 1024):
+        """
+            slots: records a new table has room for
+            indexed: heights below this are all in the table, as of the last
+                     flush()
+        """
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        if os.fstat(self._fd).st_size < _HEADERS_HEADER.size:
+            os.ftruncate(self._fd, _HEADERS_HEADER.size + slots * _HEADER_RECORD.size)
+            os.pwrite(self._fd, _HEADERS_HEADER.pack(_HEADERS_MAGIC, _HEADERS_VERSION, 0), 0)
+        self._map = mmap.mmap(self._fd, 0)
+        magic, version, self.indexed = _HEADERS_HEADER.unpack_from(self._map, 0)
+        if magic != _HEADERS_MAGIC or version != _HEADERS_VERSION:
+            raise ValueError(f"{path} is not a block header index")
+
+    def get(self, height: int) -> BlockHeader:
+        prev_hash, merkle_root, timestamp, target, nonce = _HEADER_RECORD.unpack_from(
+            self._map, _HEADERS_HEADER.size + height * _HEADER_RECORD.size)
+        return BlockHeader(prev_hash.hex(), merkle_root.hex(), timestamp, nonce, int.from_bytes(target, "big"))
+
+    def put(self, height: int, header):
+        position = _HEADERS_HEADER.size + height * _HEADER_RECORD.size
+        if position + _HEADER_RECORD.size > len(self._map):
+            # grow by doubling, so remapping is rare
+            self._map.resize(_HEADERS_HEADER.size + 2 * (len(self._map) - _HEADERS_HEADER.size))
+        _HEADER_RECORD.pack_into(self._map, position, bytes.fromhex(header.prev_hash),
+                                 bytes.fromhex(header.merkle_root), header.timestamp,
+                                 header.target.to_bytes(32, "big"), header.nonce)
+
+    def flush(self, indexed: int):
+        """
+            Writes the records back, then records that heights below indexed
+            are in them.
+        """
+        self._map.flush()
+        self.indexed = indexed
+        _HEADERS_HEADER.pack_into(self._map, 0, _HEADERS_MAGIC, _HEADERS_VERSION, indexed)
+        self._map.flush(0, mmap.PAGESIZE)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+class BlockStore:
+    """
+        Blocks on disk. blocks.dat is an append-only file of encoded blocks,
+        and heights.idx is a memory-mapped table with one fixed-size record
+        per height (offset, length and hash of the block). hashes.idx, a
+        HashIndex, maps hashes back to heights. Any block can be read by
+        height or hash without loading the others, and opening a store only
+        reads the headers of its index files. headers.idx, a HeaderIndex,
+        keeps every block's header, so a run of headers costs no block reads.
+
+        Appends go to the OS straight away but are only fsynced every
+        sync_every blocks or sync_interval seconds, whichever comes first.
+    """
+    def __init__(self, directory: str, sync_every: int = 16, sync_interval: float = 5.0):
+        """
+            directory: where blocks.dat and heights.idx live, created if missing
+            sync_every: blocks appended between fsyncs
+            sync_interval: most seconds between fsyncs while appending
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        self._data_fd = os.open(os.path.join(directory, "blocks.dat"), os.O_RDWR | os.O_CREAT | os.O_APPEND)
+        index_path = os.path.join(directory, "heights.idx")
+        self._index_fd = os.open(index_path, os.O_RDWR | os.O_CREAT)
+        if os.fstat(self._index_fd).st_size < _INDEX_HEADER.size:
+            os.ftruncate(self._index_fd, _INDEX_HEADER.size + 1024 * _INDEX_RECORD.size)
+            os.pwrite(self._index_fd, _INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, 0), 0)
+        self._index = mmap.mmap(self._index_fd, 0)
+        magic, version, self._count = _INDEX_HEADER.unpack_from(self._index, 0)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+            raise ValueError(f"{index_path} is not a block index")
+
+        # drop index records pointing past the end of the data file (crash
+        # between writing the data and syncing it)
+        data_size = os.fstat(self._data_fd).st_size
+        while self._count and sum(self._record(self._count - 1)[:2]) > data_size:
+            self._count -= 1
+
+        self._hashes = HashIndex(os.path.join(directory, "hashes.idx"))
+        # only heights appended since the last flush (or every height of a
+        # store from before hashes.idx existed) are missing from it
+        if self._hashes.indexed < self._count:
+            for height in range(self._hashes.indexed, self._count):
+                self._hashes.put(self._record(height)[2], height)
+            self._hashes.flush(self._count)
+
+        self._headers = HeaderIndex(os.path.join(directory, "headers.idx"))
+        # same for headers.idx, but filling it means decoding the blocks
+        if self._headers.indexed < self._count:
+            for height in range(self._headers.indexed, self._count):
+                self._headers.put(height, self.get(height))
+            self._headers.flush(self._count)
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, height: int):
+        return _INDEX_RECORD.unpack_from(self._index, _INDEX_HEADER.size + height * _INDEX_RECORD.size)
+
+    def hash_at(self, height: int) -> str:
+        """
+            Hash of the block at a height, read from the index only.
+        """
+        return self._record(height)[2].hex()
+
+    def header_at(self, height: int) -> BlockHeader:
+        """
+            Header of the block at a height, read from headers.idx. A record
+            left by a truncated branch (the table isn't rewritten when a
+            crash cuts a reorg short) doesn't hash to the height's block, and
+            the block is decoded instead.
+        """
+        if not 0 <= height < self._count:
+            raise IndexError(height)
+        header = self._headers.get(height)
+        header.genesis = height == 0
+        if header.hash != self.hash_at(height):
+            return self.get(height).header()
+        return header
+
+    def get(self, height: int):
+        """
+            Reads and decodes the block at a height.
+        """
+        if not 0 <= height < self._count:
+            raise IndexError(height)
+        offset, length, _ = self._record(height)
+        block, _ = codec.decode_block(os.pread(self._data_fd, length, offset))
+        block.genesis = height == 0 # the wire format has no genesis flag
+        return block
+
+    def height_of(self, block_hash: str) -> int:
+        """
+            Height of the stored block with a given hash, or None.
+        """
+        height = self._hashes.get(bytes.fromhex(block_hash))
+        if height is None or height >= self._count or self.hash_at(height) != block_hash:
+            return None
+        return height
+
+    def get_by_hash(self, block_hash: str):
+        """
+            Reads the block with a given hash, or None if it isn't stored.
+        """
+        height = self.height_of(block_hash)
+        return None if height is None else self.get(height)
+
+    def append(self, block):
+        """
+            Writes a block at the next height.
+        """
+        data = codec.encode_block(block)
+        offset = os.lseek(self._data_fd, 0, os.SEEK_END)
+        os.write(self._data_fd, data)
+
+        position = _INDEX_HEADER.size + self._count * _INDEX_RECORD.size
+        if position + _INDEX_RECORD.size > len(self._index):
+            # grow the index by doubling, so remapping is rare
+            self._index.resize(_INDEX_HEADER.size + 2 * (len(self._index) - _INDEX_HEADER.size))
+        raw_hash = bytes.fromhex(block.hash)
+        _INDEX_RECORD.pack_into(self._index, position, offset, len(data), raw_hash)
+        self._hashes.put(raw_hash, self._count)
+        self._headers.put(self._count, block)
+        self._set_count(self._count + 1)
+
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+            self.flush()
+
+    def truncate(self, height: int):
+        """
+            Forgets the blocks from height on, e.g. when a reorg disconnects
+            them. Their data stays in blocks.dat but is never read again, and
+            their hashes.idx slots are ignored by height_of().
+        """
+        self._set_count(min(height, self._count))
+        self._unsynced += 1
+
+    def _set_count(self, count: int):
+        self._count = count
+        _INDEX_HEADER.pack_into(self._index, 0, _INDEX_MAGIC, _INDEX_VERSION, count)
+
+    def flush(self):
+        """
+            fsyncs the data file, then the indexes, so they never point at
+            data that isn't on disk.
+        """
+        os.fsync(self._data_fd)
+        self._index.flush()
+        self._hashes.flush(self._count)
+        self._headers.flush(self._count)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self._index.close()
+        os.close(self._index_fd)
+        self._hashes.close()
+        self._headers.close()
+        os.close(self._data_fd)
+
+class StoredChain:
+    """
+        List-like view of a BlockStore, used as Chain.chain when a node keeps
+        its blocks on disk. Supports what Chain needs from a list: len,
+        indexing (negative too), slicing, iteration, append and pop. Recently
+        used blocks are kept decoded in a cache.
+    """
+    def __init__(self, store: BlockStore, cache_size: int = 256):
+        self.store = store
+        self._cache = LRUCache(cache_size)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        block = self._cache.get(index)
+        if block is None:
+            block = self.store.get(index)
+            self._cache.put(index, block)
+        return block
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def append(self, block):
+        self._cache.put(len(self.store), block)
+        self.store.append(block)
+
+    def pop(self):
+        block = self[-1]
+        self._cache.pop(len(self.store) - 1)
+        self.store.truncate(len(self.store) - 1)
+        return block
+
+class StoredHeights:
+    """
+        Dict-like view of a BlockStore's hash index, used as
+        Chain.block_heights when a node keeps its blocks on disk, so the
+        hashes of the whole chain aren't held in memory. The store records a
+        block's height when it is appended and forgets it when truncated, so
+        setting and deleting are no-ops.
+    """
+    def __init__(self, store: BlockStore):
+        self.store = store
+
+    def get(self, block_hash: str, default=None):
+        height = self.store.height_of(block_hash)
+        return default if height is None else height
+
+    def __contains__(self, block_hash: str):
+        return self.store.height_of(block_hash) is not None
+
+    def __getitem__(self, block_hash: str):
+        height = self.store.height_of(block_hash)
+        if height is None:
+            raise KeyError(block_hash)
+        return height
+
+    def __setitem__(self, block_hash: str, height: int):
+        pass
+
+    def __delitem__(self, block_hash: str):
+        pass
+
+    def __len__(self):
+        return len(self.store)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+import base64
+import heapq
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from blockchain.block import Block
+    from blockchain.chain import Chain
+    from blockchain.transaction import Transaction
+
+MAX_BLOCK_TRANSACTIONS = 2000 # including the mining reward
+MAX_BLOCK_BYTES = 512 * 1024 # transactions and signatures, see block_size
+
+def transaction_size(transaction: Transaction, sign: str) -> int:
+    """
+        Bytes a transaction takes in a block: its encoding and raw signature.
+    """
+    size = len(transaction.serialize())
+    if sign is not None:
+        size += len(base64.b64decode(sign))
+    return size
+
+def block_size(block: Block) -> int:
+    """
+        Bytes of all transactions and signatures of a block, what
+        MAX_BLOCK_BYTES limits.
+    """
+    return sum(transaction_size(tx, sign) for tx, sign in zip(block.transactions, block.signatures))
+
+class BlockTemplate:
+    """
+        The mempool transactions the next block will hold, capped by count and
+        size. Candidates wait in a heap, oldest first (transactions carry no
+        fee), and only move into the template when they pass the same checks
+        as a received block. New transactions are pushed as they arrive and
+        fill the free room on the next select(), so mining rounds on the same
+        tip don't rebuild anything. Only a new tip starts the template over.
+    """
+    def __init__(self, chain: Chain, max_transactions: int = MAX_BLOCK_TRANSACTIONS,
+                 max_bytes: int = MAX_BLOCK_BYTES):
+        """
+            max_transactions, max_bytes: block limits, see check_block
+            transactions, signatures: what the template holds so far
+            size: bytes of transactions and signatures in it
+            full: whether the last select() ran out of room before running
+                  out of candidates
+            _heap: (timestamp, arrival number, tx, signature) of candidates
+            _tip: hash of the block the template was built on
+            _delta, _seen: state of Chain.check_transaction over the template
+        """
+        self.chain = chain
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self._heap = []
+        self._arrivals = 0
+        self._tip = None
+        self.full = False
+        self.reset()
+
+    def reset(self):
+        """
+            Empties the template and queues every mempool transaction again.
+        """
+        self.transactions = []
+        self.signatures = []
+        self.size = 0
+        self._delta = {}
+        self._seen = set()
+        self._heap = []
+        for tx, sign in self.chain.mempool:
+            self._heap.append(self._entry(tx, sign))
+        heapq.heapify(self._heap)
+        self._tip = self.chain.tip_hash
+
+    def _entry(self, transaction: Transaction, sign: str):
+        self._arrivals += 1
+        return (transaction.timestamp, self._arrivals, transaction, sign)
+
+    def add(self, transaction: Transaction, sign: str):
+        """
+            Queues a transaction that just entered the mempool.
+        """
+        heapq.heappush(self._heap, self._entry(transaction, sign))
+
+    def select(self):
+        """
+            Brings the template up to date and returns its (transactions,
+            signatures), without the mining reward.
+        """
+        if self._tip != self.chain.tip_hash:
+            self.reset()
+        # one slot is the mining reward
+        room = self.max_transactions - 1 - len(self.transactions)
+        while room > 0 and self._heap:
+            _, _, tx, sign = self._heap[0]
+            if tx.txid not in self.chain.mempool:
+                heapq.heappop(self._heap)
+                continue
+            size = transaction_size(tx, sign)
+            if self.size + size > self.max_bytes:
+                break # full, it stays queued for a later block
+            heapq.heappop(self._heap)
+            if self.chain.check_transaction(tx, sign, self._delta, self._seen) is not None:
+                continue # e.g. a double spend of one already in; Chain.revalidate_mempool() drops the loser
+            self.transactions.append(tx)
+            self.signatures.append(sign)
+            self.size += size
+            room -= 1
+        self.full = bool(self._heap)
+        return self.transactions, self.signatures
@@ -1,10 +1,45 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 import time
+import math
+import hashlib
+import struct
 
 if TYPE_CHECKING:
     from blockchain.wallet import Wallet
 
+TX_VERSION = 1
+COINBASE_FLAG = 0x01 # set when the payer is the coinbase
+_HEADER = struct.Struct(">BBdd") # version, flags, amount, timestamp
+
+def pack_key(key: str) -> bytes:
+    """
+        Packs a public key compactly. Real keys are lowercase hex and are
+        stored as raw bytes, placeholder keys like '0x1' as utf-8. Either
+        way the length must fit in one byte, longer keys raise ValueError.
+    """
+    try:
+        raw = bytes.fromhex(key)
+        if raw.hex() == key:
+            return bytes([0, len(raw)]) + raw
+    except ValueError:
+        pass
+    text = key.encode()
+    if len(text) > 255:
+        raise ValueError("public key longer than 255 bytes")
+    return bytes([1, len(text)]) + text
+
+def unpack_key(data: bytes, offset: int):
+    """
+        Reverses pack_key. Returns the key and the offset right after it.
+    """
+    kind, length = data[offset], data[offset + 1]
+    raw = data[offset + 2:offset + 2 + length]
+    if len(raw) != length:
+        raise ValueError("truncated public key")
+    key = raw.hex() if kind == 0 else raw.decode()
+    return key, offset + 2 + length
+
 class Transaction:
     """
         Transaction packages one transaction instance, containing
@@ -16,26 +51,79 @@ class Transaction:
             payer: money sender
             payee: money receiver
             timestamp: when the transaction was created
+            _encoded, _txid: memoized serialize() and txid
         """
         self.amount = amount
         self.payer = payer
         self.payee_public_key = payee_public_key
         self.timestamp = time.time()
+        self._encoded = None
+        self._txid = None
 
-    def to_dict(self): # for hashing
+    def serialize(self) -> bytes:
         """
-            Converts the transaction into a formatted dictionary which
-            is then used in the hashing of the block.
+            Canonical byte encoding of the transaction: version, flags, amount
+            and timestamp as big-endian doubles, then the payer and payee keys.
+            The same transaction always encodes to the same bytes, whether
+            amount is an int or a float.
         """
-        return {
-            "amount": self.amount,
-            "payer": self.payer.public_key if self.payer else "coinbase",
-            "payee": self.payee_public_key
-        }
+        if self._encoded is None:
+            flags = COINBASE_FLAG if self.is_coinbase else 0
+            self._encoded = (_HEADER.pack(TX_VERSION, flags, float(self.amount), float(self.timestamp))
+                             + pack_key(self.payer.public_key)
+                             + pack_key(self.payee_public_key))
+        return self._encoded
 
     def to_sign(self): # changes into payload for signature
         """
             Converts the transaction into a string which is used for signing
-            the block.
+            the block. This is the hex of the canonical encoding.
+        """
+        return self.serialize().hex()
+
+    @property
+    def is_coinbase(self) -> bool:
         """
-        return f"{self.amount}:{self.payer.public_key}->{self.payee_public_key}:{self.timestamp}"
\ No newline at end of file
+            Whether the transaction carries the coinbase flag. Any wallet can
+            be named "coinbase", so the flag alone proves nothing: only the
+            first transaction of a block (its mining reward) may have it, see
+            Chain.check_block and Chain.check_transaction.
+        """
+        return self.payer.name == "coinbase"
+
+    @property
+    def txid(self):
+        """
+            The transaction's identity: sha256 of its canonical encoding. Used
+            for mempool and chain lookups and as its leaf in the block's
+            merkle tree. Memoized.
+        """
+        if self._txid is None:
+            self._txid = hashlib.sha256(self.serialize()).hexdigest()
+        return self._txid
+
+
+    @classmethod
+    def deserialize(cls, data: bytes, offset: int = 0):
+        """
+            Decodes a transaction written by serialize(). The payer comes back
+            as a watch-only Wallet. Returns the transaction and the offset
+            right after it.
+        """
+        from blockchain.wallet import Wallet
+        version, flags, amount, timestamp = _HEADER.unpack_from(data, offset)
+        if version != TX_VERSION:
+            raise ValueError(f"unknown transaction version {version}")
+        if not math.isfinite(amount):
+            raise ValueError("transaction amount is not a finite number")
+        payer_key, offset = unpack_key(data, offset + _HEADER.size)
+        payee_key, offset = unpack_key(data, offset)
+
+        transaction = cls.__new__(cls)
+        transaction.amount = amount
+        transaction.payer = Wallet.from_public_key(payer_key, "coinbase" if flags & COINBASE_FLAG else None)
+        transaction.payee_public_key = payee_key
+        transaction.timestamp = timestamp
+        transaction._encoded = None
+        transaction._txid = None
+        return transaction, offset
\ No newline at end of file
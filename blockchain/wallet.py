@@ -27,6 +27,20 @@ class Wallet:
         self.private_key = self._sk.to_string().hex()
         self.public_key = self._vk.to_string().hex()
 
+    @classmethod
+    def from_public_key(cls, public_key: str, name: str = None):
+        """
+            Creates a watch-only Wallet that only knows a public key, e.g. the
+            payer of a transaction decoded off the wire. It cannot sign.
+        """
+        wallet = cls.__new__(cls)
+        wallet.name = name if name is not None else public_key[:8]
+        wallet._sk = None
+        wallet._vk = None
+        wallet.private_key = None
+        wallet.public_key = public_key
+        return wallet
+
     def sign(self, transaction):
         """
             Creates a signature using the transaction and returns it as a str.
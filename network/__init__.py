@@ -1,2 +1,3 @@
 from .peer import Peer
-from .tracker import Tracker
\ No newline at end of file
+from .tracker import Tracker
+from .async_peer import AsyncPeer
\ No newline at end of file
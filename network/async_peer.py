@@ -0,0 +1,213 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from network.peer import Peer, LINK_RETRY, ADDR_INTERVAL, SYNC_TIMEOUT, SYNC_QUORUM, RECV_SIZE
+from network.protocol import FrameDecoder, hello_message
+from network.outbound import AsyncOutboundQueue, DISCONNECT, MAX_QUEUED_BYTES
+from network.scheduler import MiningPolicy
+
+TRACKER_LINE_LIMIT = 16 * 1024 * 1024 # longest line read from the tracker
+
+class AsyncPeer(Peer):
+    """
+        Peer that runs its networking on a single asyncio event loop instead
+        of one thread per connection. Accepting, reading, broadcasting and
+        tracker updates all happen on the loop. Message handling (signature
+        checks, chain updates) runs on one handler thread and mining on
+        another, so the thread count stays the same however many peers are
+        connected. All blockchain logic is inherited from Peer; broadcast()
+        and send_to() work unchanged since each peer's outbound queue is
+        written by a task on the loop.
+
+        The loop never takes self.lock itself: the handler thread holds it
+        through accept_block() and the miner through add_block(), which can
+        fsync the store, and every peer's reads and writes would stall
+        meanwhile. Peer table updates go through _off_loop() instead.
+    """
+    def __init__(self, port: int, name: str, tracker_addr: int, tracker_port: int, mining_workers: int = 1, data_dir: str = None,
+                 outbound_bytes: int = MAX_QUEUED_BYTES, overflow_policy: str = DISCONNECT,
+                 mining_policy: MiningPolicy = None, outbound_links: int = None, inbound_links: int = None,
+                 bootstrap: list = None, sync_timeout: float = SYNC_TIMEOUT, sync_quorum: int = SYNC_QUORUM):
+        """
+            peers: {peer_id : asyncio.StreamWriter} instead of sockets
+            outbound: {peer_id : AsyncOutboundQueue}
+            loop: the event loop, set once start() runs
+        """
+        super().__init__(port, name, tracker_addr, tracker_port, mining_workers, data_dir,
+                         outbound_bytes, overflow_policy, mining_policy, outbound_links, inbound_links, bootstrap,
+                         sync_timeout, sync_quorum)
+        self.loop = None
+        self.tracker_writer = None
+        # one thread keeps messages handled in arrival order, like the lock did
+        self._handler_executor = ThreadPoolExecutor(1, thread_name_prefix=f"handler-{port}")
+
+    def start(self):
+        """
+        Entry point to start the peer node. Blocks, running the event loop.
+        """
+        asyncio.run(self.run())
+
+    async def run(self):
+        """
+        Connects to the tracker and the peers, then serves connections,
+        tracker updates and mining until cancelled.
+        """
+        self.loop = asyncio.get_running_loop()
+        # listen before the tracker announces us, so peers can connect right away
+        server = await asyncio.start_server(self._on_inbound, "localhost", self.port)
+        print(f"[listener_thread] {self.port} is listening")
+
+        tracker_reader = None
+        peer_list = []
+        if self.tracker_addr is not None:
+            # the peer and member lists are single lines that grow with the network
+            tracker_reader, self.tracker_writer = await asyncio.open_connection(self.tracker_addr, self.tracker_port,
+                                                                                limit=TRACKER_LINE_LIMIT)
+            print(f"[connect_to_tracker] {self.port} connected to tracker at {self.tracker_addr}:{self.tracker_port}")
+            self.tracker_writer.write(b"SYN")
+            self.tracker_writer.write(f"{self.port}|{self.wallet.public_key}|{self.wallet.name}\n".encode())
+            data = (await tracker_reader.readline()).decode()
+            peer_list, self.tracker_buffer = self.parse_peer_list(data)
+
+        candidates = await self._off_loop(self.join_candidates, peer_list)
+        await asyncio.gather(*(self._connect(peer) for peer in candidates))
+
+        # the mining scheduler blocks between rounds, so it gets a thread
+        threading.Thread(target=self.scheduler.run, daemon=True, name=f"miner-{self.port}").start()
+        self.loop.create_task(self._address_refresh())
+        async with server:
+            if tracker_reader is not None:
+                await self._tracker_updates(tracker_reader)
+            await server.serve_forever()
+
+    def _off_loop(self, func, *args):
+        """
+        Runs func(*args) in the loop's default executor, for work that takes
+        self.lock. Returns the asyncio future. Only called on the loop.
+        """
+        return self.loop.run_in_executor(None, func, *args)
+
+    async def _connect(self, peer: str):
+        """
+        Opens an outgoing connection to a peer picked by link_candidates().
+        """
+        if peer in self.peers:
+            return
+        try:
+            ip, port = peer.split(":")
+            reader, writer = await asyncio.open_connection(ip, int(port))
+        except OSError as e:
+            print(f"[form_peer_connections] {self.port} connection error when connecting to {peer}: {e}")
+            await self._off_loop(self.link_failed, peer)
+            return
+        print(f"[form_peer_connections] {self.port} connected to {peer}")
+        await self._register(peer, reader, writer)
+
+    async def _on_inbound(self, reader, writer):
+        """
+        Called by the server for every accepted connection.
+        """
+        addr = writer.get_extra_info("peername")
+        if not await self._off_loop(self.accepts_inbound):
+            print(f"[listener_thread] {self.port} has {self.inbound_links} inbound links, refusing {addr}")
+            writer.close()
+            return
+        print(f"[listener_thread] {self.port} accepted connection from {addr}")
+        await self._register(f"{addr[0]}:{addr[1]}", reader, writer)
+
+    async def _register(self, peer_id, reader, writer):
+        """
+        Sets up a new connection's outbound queue, records the link off the
+        loop, then starts reading from it.
+        """
+        queue = AsyncOutboundQueue(writer, peer_id, self._drop_off_loop, self.loop,
+                                   self.outbound_bytes, self.overflow_policy)
+        queue.put(hello_message(self.port))
+        await self._off_loop(self.add_link, peer_id, writer, queue)
+        self.loop.create_task(self._receive(reader, writer, peer_id))
+
+    def link_failed(self, address):
+        """
+        Like Peer.link_failed(), with the retry timed by the loop. Runs off
+        the loop.
+        """
+        with self.lock:
+            self.dialed.discard(address)
+            self.address_book.pop(address, None)
+        if self.outbound_links is not None:
+            self.loop.call_soon_threadsafe(self.loop.call_later, LINK_RETRY, self._off_loop, self.fill_links)
+
+    def connect_peer(self, address):
+        """
+        Connects to a peer on the loop, from any thread.
+        """
+        asyncio.run_coroutine_threadsafe(self._connect(address), self.loop)
+
+    def drop_peer(self, peer_id):
+        """
+        Disconnects a peer whose writes failed, whose queue overflowed or
+        that we are linked to twice. Runs off the loop, see _drop_off_loop().
+        """
+        with self.lock:
+            writer = self.peers.get(peer_id)
+        self.remove_peer(peer_id)
+        if writer is not None:
+            self.loop.call_soon_threadsafe(writer.close)
+
+    def _drop_off_loop(self, peer_id):
+        """
+        drop_peer() for the outbound queues, which fail on the loop.
+        """
+        self._off_loop(self.drop_peer, peer_id)
+
+    async def _receive(self, reader, writer, peer_id):
+        """
+        Reads messages from one peer and hands them to the handler thread.
+        Waits for each group to be handled before reading on, so messages
+        from a peer keep their order.
+        """
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    break
+                try:
+                    received = decoder.feed(data)
+                except ValueError as e:
+                    print(f"[receive_from_peer] decode error: {e}")
+                    break
+                msgs = await self._off_loop(self.accept_messages, peer_id, received)
+                if msgs:
+                    await self.loop.run_in_executor(self._handler_executor, self.handle_messages, msgs, peer_id)
+        except Exception as e:
+            print(f"[receive_from_peer] error: {e}")
+        finally:
+            self._off_loop(self.remove_peer, peer_id)
+            writer.close()
+
+    async def _tracker_updates(self, reader):
+        """
+        Applies membership updates from the tracker as lines arrive.
+        """
+        while True:
+            line = await reader.readline()
+            if not line:
+                print(f"[tracker_thread] {self.port} lost connection to tracker")
+                return
+            await self._off_loop(self.apply_tracker_update, line.decode())
+
+    async def _address_refresh(self):
+        """
+        Calls refresh_addresses() every ADDR_INTERVAL seconds.
+        """
+        while True:
+            await asyncio.sleep(ADDR_INTERVAL)
+            await self._off_loop(self.refresh_addresses)
+
+    def request_members(self):
+        """
+        Asks the tracker for the full member list again. Only called from
+        apply_tracker_update(), which runs off the loop.
+        """
+        self.loop.call_soon_threadsafe(self.tracker_writer.write, b"RESYNC\n")
@@ -0,0 +1,189 @@
+import asyncio
+import socket
+import threading
+from collections import deque
+
+# What a peer's outbound queue does when a message doesn't fit:
+DISCONNECT = "disconnect" # the peer can't keep up, drop the connection
+DROP_NEWEST = "drop_newest" # discard the message that didn't fit
+DROP_OLDEST = "drop_oldest" # discard queued messages until it fits
+OVERFLOW_POLICIES = (DISCONNECT, DROP_NEWEST, DROP_OLDEST)
+
+MAX_QUEUED_BYTES = 4 * 1024 * 1024 # default bound of one peer's queue
+
+class _BoundedQueue:
+    """
+        The bookkeeping shared by both outbound queues: encoded messages up
+        to max_bytes, and the overflow policy for what doesn't fit. A single
+        message bigger than max_bytes is still accepted into an empty queue.
+    """
+    def __init__(self, peer_id: str, on_failure, max_bytes: int, policy: str):
+        """
+            on_failure: called with peer_id when a write fails or the
+                        DISCONNECT policy triggers
+            dropped: number of messages discarded by the DROP_* policies
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy {policy}")
+        self.peer_id = peer_id
+        self.on_failure = on_failure
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.dropped = 0
+        self._items = deque()
+        self._bytes = 0
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def _offer(self, data: bytes) -> bool:
+        """
+            Queues data if the policy allows. Returns None when the peer has
+            to be disconnected, otherwise whether data was queued.
+        """
+        if self._closed:
+            return False
+        if self._items and self._bytes + len(data) > self.max_bytes:
+            if self.policy == DISCONNECT:
+                print(f"[outbound] {self.peer_id} is not keeping up ({self._bytes} bytes queued), disconnecting")
+                self._closed = True
+                self._items.clear()
+                self._bytes = 0
+                return None
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            while self._items and self._bytes + len(data) > self.max_bytes:
+                self._bytes -= len(self._items.popleft())
+                self.dropped += 1
+        self._items.append(data)
+        self._bytes += len(data)
+        return True
+
+    def _take(self) -> bytes:
+        data = self._items.popleft()
+        self._bytes -= len(data)
+        return data
+
+class OutboundQueue(_BoundedQueue):
+    """
+        Messages waiting to be sent to one peer, written by a thread of its
+        own so a slow peer only ever stalls itself. put() never blocks.
+    """
+    def __init__(self, conn, peer_id: str, on_failure, max_bytes: int = MAX_QUEUED_BYTES,
+                 policy: str = DISCONNECT):
+        """
+            conn: the peer's socket
+        """
+        super().__init__(peer_id, on_failure, max_bytes, policy)
+        self.conn = conn
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True, name=f"writer-{peer_id}").start()
+
+    def put(self, data: bytes) -> bool:
+        """
+            Queues a message. Returns False if it was dropped.
+        """
+        with self._cond:
+            queued = self._offer(data)
+            if queued:
+                self._cond.notify()
+        if queued is None:
+            self.on_failure(self.peer_id)
+        return bool(queued)
+
+    def close(self):
+        """
+            Stops the writer and discards what hasn't been sent.
+        """
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._bytes = 0
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                data = self._take()
+            try:
+                self.conn.sendall(data)
+            except OSError as e:
+                print(f"[outbound] error sending to {self.peer_id}: {e}")
+                self.on_failure(self.peer_id)
+                return
+
+class AsyncOutboundQueue(_BoundedQueue):
+    """
+        OutboundQueue for a connection served by an asyncio loop: a writer
+        task instead of a thread, waiting on drain() so the queue fills up
+        when the peer reads slowly. Must be created on the loop; put() and
+        close() can be called from any thread.
+    """
+    def __init__(self, writer: asyncio.StreamWriter, peer_id: str, on_failure, loop,
+                 max_bytes: int = MAX_QUEUED_BYTES, policy: str = DISCONNECT):
+        super().__init__(peer_id, on_failure, max_bytes, policy)
+        self.writer = writer
+        self.loop = loop
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def _on_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def put(self, data: bytes) -> bool:
+        """
+            Queues a message. From another thread it is handed to the loop
+            and True is returned; drops are then only counted.
+        """
+        if not self._on_loop():
+            self.loop.call_soon_threadsafe(self.put, data)
+            return True
+        queued = self._offer(data)
+        if queued:
+            self._wakeup.set()
+        elif queued is None:
+            self.on_failure(self.peer_id)
+        return bool(queued)
+
+    def close(self):
+        """
+            Stops the writer task and discards what hasn't been sent.
+        """
+        if not self._on_loop():
+            self.loop.call_soon_threadsafe(self.close)
+            return
+        self._closed = True
+        self._items.clear()
+        self._bytes = 0
+        self._task.cancel()
+
+    async def _run(self):
+        try:
+            while True:
+                while not self._items:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                self.writer.write(self._take())
+                await self.writer.drain()
+        except (OSError, ConnectionError) as e:
+            print(f"[outbound] error sending to {self.peer_id}: {e}")
+            self.on_failure(self.peer_id)
+
+def shutdown(conn):
+    """
+        Closes a peer socket so that a thread blocked reading it wakes up.
+    """
+    try:
+        conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    conn.close()
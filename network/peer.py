@@ -1,25 +1,125 @@
-import socket, json, time, threading
+import socket, json, time, threading, random
 from blockchain import Chain, Wallet, Transaction, Block
-import pickle
-import base64
+from blockchain.chain import verify_transaction, verify_transactions
+from blockchain.store import BlockStore
+from blockchain.cache import LRUCache
+from blockchain.blocktree import block_work
+from network.protocol import FrameDecoder, hello_message, negotiate, encode, BINARY, MAX_FRAME_BYTES
+from network.outbound import OutboundQueue, shutdown, DISCONNECT, MAX_QUEUED_BYTES
+from network.scheduler import MiningScheduler, MiningPolicy
+from network.rpc import RequestTracker
+
+MAX_HEADERS = 2000 # most headers sent in one "headers" reply, and most hashes read from a "getblocks"
+MAX_LOCATOR = 64 # most locator hashes looked up, a locator has about 10 + log2(height)
+MAX_BLOCKS_BYTES = MAX_FRAME_BYTES // 2 # most transaction bytes sent in one "blocks" reply
+# messages still handled while syncing (request mode)
+SYNC_TYPES = {"getheaders", "headers", "getblocks", "blocks", "getdata", "getaddr", "addr"}
+SEEN_SIZE = 50000 # inventory items remembered by the seen filter
+REQUEST_TIMEOUT = 5.0 # seconds before an item asked for in a getdata is asked again
+LINK_RETRY = 10.0 # seconds before connecting to the same address again
+ADDR_SAMPLE = 100 # most address book entries sent in one "addr" message
+ADDR_RELAY = 2 # peers a newly announced address is passed on to
+ADDR_INTERVAL = 60.0 # seconds between address book refreshes from a random link
+MAX_ADDRESSES = 1000 # most addresses kept in the address book
+MAX_NAME_LENGTH = 64 # longest peer name accepted from peer exchange
+SYNC_TIMEOUT = 10.0 # seconds a peer has to answer a sync request
+SYNC_QUORUM = 3 # sync replies after which a round may finish without the rest
+RECV_SIZE = 256 * 1024 # most bytes read from a peer before its messages are handled
+
+def valid_entry(address, public_key, name) -> bool:
+    """
+        Whether a peer exchange entry is well formed: an "ip:port" address
+        with a numeric port, a 128 hex digit public key like Wallet's, and a
+        short name. Anything else is dropped, it could not be dialed or
+        packed into an "addr" reply anyway.
+    """
+    if not (isinstance(address, str) and isinstance(public_key, str) and isinstance(name, str)):
+        return False
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+        return False
+    if len(public_key) != 128 or any(c not in "0123456789abcdef" for c in public_key):
+        return False
+    return len(name) <= MAX_NAME_LENGTH
 
 class Peer:
     """
         Peer class that functions as each node in the network.
     """
-    def __init__(self, port: int, name: str, tracker_addr: int, tracker_port: int):
+    def __init__(self, port: int, name: str, tracker_addr: int, tracker_port: int, mining_workers: int = 1, data_dir: str = None,
+                 outbound_bytes: int = MAX_QUEUED_BYTES, overflow_policy: str = DISCONNECT,
+                 mining_policy: MiningPolicy = None, outbound_links: int = None, inbound_links: int = None,
+                 bootstrap: list = None, sync_timeout: float = SYNC_TIMEOUT, sync_quorum: int = SYNC_QUORUM):
+        """
+            mining_workers: processes used for mining, None for one per core
+            mining_policy: when to mine, see network/scheduler.py. None uses
+                           the default MiningPolicy()
+            data_dir: directory for the on-disk block store, None keeps the
+                      chain in memory only
+            outbound_bytes: most bytes waiting to be sent to one peer
+            overflow_policy: what happens beyond that, see network/outbound.py
+            outbound_links: how many connections to open and keep open, None
+                            to connect to every peer (full mesh)
+            inbound_links: most connections accepted from others, None for
+                           no limit
+            bootstrap: "ip:port" addresses of peers to join through, used
+                       along with the tracker's list, or instead of it when
+                       tracker_addr is None
+            sync_timeout: seconds a peer has to answer a sync request before
+                          the round goes on without it
+            sync_quorum: how many sync replies are enough to pick the best
+                         branch, None to wait for every peer
+        """
         self.tracker_addr = tracker_addr
         self.tracker_port = tracker_port
         self.port = port
         self.peers = {} # {"addre:port" as one peer_id string : socket}
+        self.outbound = {} # {peer_id : OutboundQueue of messages waiting to be sent}
+        self.outbound_bytes = outbound_bytes
+        self.overflow_policy = overflow_policy
+        self.outbound_links = outbound_links
+        self.inbound_links = inbound_links
+        self.address_book = {address: None for address in bootstrap or []} # {listen address : public key, None if unknown}
+        self.peer_addresses = {} # {peer_id : listen address from the peer's hello}
+        self.dialed = set() # addresses we connected or are connecting to
+        self.link_attempts = {} # {address : when we last tried to connect to it}
         self.wallet = Wallet(name=name)
-        self.chain = Chain()
+        store = BlockStore(data_dir) if data_dir is not None else None
+        self.chain = Chain(mining_workers=mining_workers, store=store)
         self.socket_to_tracker = None
-        self.request_mode = False
-        self.requests = 0
-        self.longest_chain_length = 0
+        self.tracker_buffer = "" # tracker data received along with the peer list
+        self._request_mode = False
+        self.rpc = RequestTracker(sync_timeout) # outstanding requests by correlation id
+        self.sync_timeout = sync_timeout
+        self.sync_quorum = sync_quorum
+        self.sync_requests = set() # ids of the current sync round's unanswered requests
+        self.sync_replies = 0 # sync replies received so far
+        self.sync_needed = 0 # sync replies that finish the round early
+        self.blocks_request = None # id of the getblocks for the chosen branch
+        self.blocks_received = 0 # blocks of the chosen branch received so far
+        self.best_candidate = None # best branch offered during a sync, see handle_headers
         self.peer_name_map = {}
+        self.members_version = -1 # version of the tracker's member list we have
+        self.seen = LRUCache(SEEN_SIZE) # (kind, hash) of transactions and blocks already received or announced
+        self.requested = LRUCache(SEEN_SIZE) # (kind, hash) -> when it was asked for in a getdata
         self.lock = threading.RLock()
+        self.scheduler = MiningScheduler(self.chain, self.mine_block, mining_policy or MiningPolicy(),
+                                         paused=lambda: self.request_mode)
+
+    @property
+    def request_mode(self):
+        """
+        Whether the peer is syncing. Mining is paused meanwhile: a running
+        search is stopped and the scheduler waits until syncing ends.
+        """
+        return self._request_mode
+
+    @request_mode.setter
+    def request_mode(self, value):
+        self._request_mode = value
+        if value:
+            self.chain.cancel_mining()
+        self.scheduler.notify()
 
     def connect_to_tracker(self):
         """
@@ -38,43 +138,133 @@ class Peer:
         try:
             self.socket_to_tracker.sendall(b"SYN")
             self.socket_to_tracker.sendall(f"{self.port}|{self.wallet.public_key}|{self.wallet.name}\n".encode())
-            data = self.socket_to_tracker.recv(4096).decode()
-            peer_list = json.loads(data)
+            data = b""
+            while b"\n" not in data:
+                chunk = self.socket_to_tracker.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            peer_list, self.tracker_buffer = self.parse_peer_list(data.decode())
             return peer_list
         except Exception as e:
             print(f"[get_peer_list] error: {e}")
             return []
         
+    @staticmethod
+    def parse_peer_list(data: str):
+        """
+            Splits the tracker's reply into the peer list and whatever came
+            after it, since the member list can arrive in the same read.
+        """
+        peer_list, end = json.JSONDecoder().raw_decode(data)
+        return peer_list, data[end:].lstrip()
+
     def form_peer_connections(self):
         """
-        Forms connections to each peer in the network, according to the peer list.
+        Forms connections to the peers in the peer list: every one of them, or
+        outbound_links random ones when the network is a bounded-degree overlay.
         Each connection creates a thread to listen for messages from that peer.
 
         A massive sweep of connections like this is only done when the peer joins the network.
         After that, it will listen for connections to accept from newly joined peers and add to the peer list.
         Or it will realize a peer has disconnected when failing to receive or send data to it, before removing it from the peer list.
+        In overlay mode, fill_links() then replaces the links that close.
+        """
+        peers = self.get_peer_list() if self.socket_to_tracker is not None else []
+        for peer in self.join_candidates(peers):
+            self.dial(peer)
+
+    def join_candidates(self, peers):
+        """
+        Adds the tracker's peer list to the address book and picks the
+        addresses to connect to when joining, see link_candidates().
+        """
+        with self.lock:
+            for peer in peers:
+                self.address_book.setdefault(peer, None)
+            return self.link_candidates()
+
+    def link_candidates(self):
+        """
+        Picks the addresses to connect to, and marks them as dialed: with
+        outbound_links None every known peer we aren't linked to, otherwise
+        random ones up to the target, skipping addresses tried in the last
+        LINK_RETRY seconds. Called under the lock.
+        """
+        linked = set(self.peers) | set(self.peer_addresses.values()) | self.dialed
+        now = time.monotonic()
+        candidates = [address for address in self.address_book
+                      if address != f"127.0.0.1:{self.port}" and address not in linked # Don't connect to self
+                      and now - self.link_attempts.get(address, -LINK_RETRY) >= LINK_RETRY]
+        if self.outbound_links is not None:
+            random.shuffle(candidates)
+            candidates = candidates[:max(0, self.outbound_links - len(self.dialed))]
+        for address in candidates:
+            self.link_attempts[address] = now
+            self.dialed.add(address)
+        return candidates
+
+    def fill_links(self):
+        """
+        Opens new outbound links: until there are outbound_links again in
+        overlay mode, e.g. after one closed or a new peer joined, and to every
+        known peer we aren't linked to in full mesh mode, e.g. the ones peer
+        exchange just told us about.
+        """
+        with self.lock:
+            candidates = self.link_candidates()
+        for address in candidates:
+            self.connect_peer(address)
+
+    def connect_peer(self, address):
+        """
+        Connects to a peer without blocking the caller.
+        """
+        threading.Thread(target=self.dial, args=(address,), daemon=True).start()
+
+    def dial(self, peer):
+        """
+        Opens an outgoing connection to a peer and starts receiving from it.
+        """
+        try:
+            ip, port = peer.split(":")
+            sock = socket.create_connection((ip, int(port)))
+        except Exception as e:
+            print(f"[refresh_peer_connections] {self.port} connection error when connecting to {peer}: {e}")
+            self.link_failed(peer)
+            return
+        self.add_peer(peer, sock)
+        print(f"[form_peer_connections] {self.port} connected to {peer}")
+        threading.Thread(target=self.receive_from_peer, args=(sock, peer), daemon=True).start()
+
+    def link_failed(self, address):
         """
-        peers = self.get_peer_list()
-        for peer in peers:
-            if peer == f"127.0.0.1:{self.port}":
-                continue # Don't connect to self
-            
-            if peer not in self.peers:
-                try:
-                    ip, port = peer.split(":")
-                    sock = socket.create_connection((ip, int(port)))
-                    peer_id = f"{ip}:{port}"
-                    with self.lock:
-                        self.peers[peer_id] = sock
-                    print(f"[form_peer_connections] {self.port} connected to {peer}")
-                    threading.Thread(target=self.receive_from_peer, args=(sock, peer_id), daemon=True).start()
-                except Exception as e:
-                    print(f"[refresh_peer_connections] {self.port} connection error when connecting to {peer}: {e}")
+        Forgets a connection attempt that failed, and the address, which may
+        be stale, and tries other peers once LINK_RETRY has passed.
+        """
+        with self.lock:
+            self.dialed.discard(address)
+            self.address_book.pop(address, None)
+        if self.outbound_links is not None:
+            timer = threading.Timer(LINK_RETRY, self.fill_links)
+            timer.daemon = True
+            timer.start()
+
+    def accepts_inbound(self):
+        """
+        Whether another incoming connection fits under inbound_links.
+        """
+        if self.inbound_links is None:
+            return True
+        with self.lock:
+            inbound = sum(1 for peer_id in self.peers if peer_id not in self.dialed)
+        return inbound < self.inbound_links
 
     def listener_thread(self):
         """
         Called by the genesis background thread to listen for incoming connections from newly joined peers.
         Upon discovering a new peer, it will create a thread to listen for messages from that peer.
+        Connections beyond inbound_links are closed right away.
         """
         listenr = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         listenr.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -84,35 +274,154 @@ class Peer:
 
         while True:
             conn, addr = listenr.accept()
+            if not self.accepts_inbound():
+                print(f"[listener_thread] {self.port} has {self.inbound_links} inbound links, refusing {addr}")
+                shutdown(conn)
+                continue
             print(f"[listener_thread] {self.port} accepted connection from {addr}")
             peer_id = f"{addr[0]}:{addr[1]}"
-            with self.lock:
-                self.peers[peer_id] = conn
+            self.add_peer(peer_id, conn)
             threading.Thread(target=self.receive_from_peer, args=(conn, peer_id), daemon=True).start()
 
+    def add_peer(self, peer_id, conn):
+        """
+        Registers a new connection with its outbound queue, which sends our
+        hello first.
+        """
+        queue = OutboundQueue(conn, peer_id, self.drop_peer, self.outbound_bytes, self.overflow_policy)
+        queue.put(hello_message(self.port))
+        self.add_link(peer_id, conn, queue)
+
+    def add_link(self, peer_id, conn, queue):
+        """
+        Records a connection and its outbound queue, then starts peer
+        exchange on it.
+        """
+        with self.lock:
+            self.peers[peer_id] = conn
+            self.outbound[peer_id] = queue
+        self.greet(peer_id)
+        self.drop_duplicate_link(peer_id)
+
+    def drop_duplicate_link(self, address):
+        """
+        Two peers that dial each other at the same time end up linked twice.
+        Once a side knows both links to an address, it keeps the one dialed
+        by the peer with the lower listen port and drops the other, so both
+        sides drop the same link. Called when an outbound link opens and
+        when a hello tells us an inbound link's listen address.
+        """
+        with self.lock:
+            if address not in self.peers or address not in self.dialed:
+                return
+            inbound = [peer_id for peer_id, listen in self.peer_addresses.items()
+                       if listen == address and peer_id != address]
+            port = int(address.rpartition(":")[2])
+            if not inbound or port == self.port:
+                return
+            duplicates = inbound if self.port < port else [address]
+        for peer_id in duplicates:
+            print(f"[drop_duplicate_link] {self.port} already linked to {address}, closing {peer_id}")
+            self.drop_peer(peer_id)
+
+    def greet(self, peer_id):
+        """
+        Starts peer exchange on a new link: the peer learns our address, key
+        and name, and peers we connected to are asked for their address book.
+        """
+        with self.lock:
+            dialed = peer_id in self.dialed
+        self.send_to(peer_id, {"type": "addr", "entries": [self.own_entry()]})
+        if dialed:
+            self.send_to(peer_id, {"type": "getaddr"})
+
+    def drop_peer(self, peer_id):
+        """
+        Disconnects a peer whose writes failed or whose queue overflowed.
+        Its receive thread notices the closed socket and exits.
+        """
+        with self.lock:
+            conn = self.peers.get(peer_id)
+        self.remove_peer(peer_id)
+        if conn is not None:
+            shutdown(conn)
+
     def tracker_thread(self):
         """
         Listens for updates from the tracker server.
-        Receives updated lists of public keys and corresponding peer names.
+        Receives membership updates with public keys and peer names.
         """
+        buffer = self.tracker_buffer
         while True:
+            while "\n" in buffer:
+                line, buffer = buffer.split("\n", 1)
+                self.apply_tracker_update(line)
             data = self.socket_to_tracker.recv(4096).decode()
-            public_keys_str, names_str = data.strip().split("|", 1)
-            updated_public_keys = json.loads(public_keys_str)
-            updated_names = json.loads(names_str)
-            with self.lock:
-                self.peer_name_map = dict(zip(updated_public_keys, updated_names))
-                updated_public_keys = set(updated_public_keys)
-                current_public_keys = list(self.chain.balances.keys())
-
-                for public_key in updated_public_keys:
-                    if public_key not in self.chain.balances:
-                        self.chain.balances[public_key] = 0
-
-                for public_key in current_public_keys:
-                    if public_key not in updated_public_keys and public_key != "0x1" and public_key != "0x0":
-                        del self.chain.balances[public_key]
-                print(f"[tracker_thread] {self.port} successfully received updated public keys")
+            if not data:
+                print(f"[tracker_thread] {self.port} lost connection to tracker")
+                return
+            buffer += data
+
+    def apply_tracker_update(self, line: str):
+        """
+        Applies one membership update from the tracker: the full "members"
+        list when we join (or resync), then "join" and "leave" deltas. Each
+        update carries the tracker's version; a delta that skips one means
+        we missed something, so the full list is asked for again. Addresses
+        go to address_book, where overlay links are picked from.
+        """
+        if not line.strip():
+            return
+        update = json.loads(line)
+        version = update["version"]
+        with self.lock:
+            if update["type"] == "members":
+                self.members_version = version
+                self.peer_name_map = {}
+                for public_key, name, address in update["members"]:
+                    self.add_member(public_key, name)
+                    self.remember_address(address, public_key)
+                print(f"[tracker_thread] {self.port} received {len(update['members'])} members")
+                return
+            if version <= self.members_version:
+                return # already part of the members list we got
+            if version != self.members_version + 1:
+                print(f"[tracker_thread] {self.port} missed tracker updates, resyncing")
+                self.request_members()
+                return
+            self.members_version = version
+            if update["type"] == "join":
+                self.add_member(update["public_key"], update["name"])
+                self.remember_address(update["address"], update["public_key"])
+            elif update["type"] == "leave":
+                self.remove_member(update["public_key"])
+                self.address_book.pop(update["address"], None)
+        # in full mesh mode the peer that joined connects to us
+        if update["type"] == "join" and self.outbound_links is not None:
+            self.fill_links()
+
+    def add_member(self, public_key, name):
+        """
+        Records the name of a peer in the network. Balances are chain state
+        and only change with blocks, never with membership.
+        """
+        self.peer_name_map[public_key] = name
+
+    def remove_member(self, public_key):
+        """
+        Forgets the name of a peer that left the network. Its balance stays
+        on the chain, it is still spendable if the wallet comes back.
+        """
+        self.peer_name_map.pop(public_key, None)
+
+    def request_members(self):
+        """
+        Asks the tracker for the full member list again.
+        """
+        try:
+            self.socket_to_tracker.sendall(b"RESYNC\n")
+        except OSError as e:
+            print(f"[request_members] {self.port} error: {e}")
 
     def receive_from_peer(self, conn, peer_id):
         """
@@ -121,172 +430,596 @@ class Peer:
         """
         with conn:
             try:
-                buffer = ""
+                decoder = FrameDecoder()
                 while True:
-                    data = conn.recv(4096).decode()
+                    data = conn.recv(RECV_SIZE)
                     if not data:
                         break
-                    buffer += data
-
-                    while "\n" in buffer:
-                        line, buffer = buffer.split("\n", 1)
+                    # a burst arrives over several reads: whatever else is
+                    # already waiting is taken too, so its transactions reach
+                    # verify_transactions() as one batch
+                    while len(data) < RECV_SIZE:
                         try:
-                            msg = json.loads(line)
-                            if self.request_mode:
-                                if msg["type"] == "chain" or msg["type"] == "request":
-                                    self.handle_message(msg)
-                            else:
-                                self.handle_message(msg)
-                        except json.JSONDecodeError as e:
-                            print(f"[receive_from_peer] JSON decode error: {e}")
-                            return
+                            # not select(), which fails for fds above 1023
+                            more = conn.recv(RECV_SIZE - len(data), socket.MSG_DONTWAIT)
+                        except BlockingIOError:
+                            break
+                        if not more:
+                            break
+                        data += more
+
+                    # every complete message of this read is handled as one
+                    # group, so a burst of transactions is verified as a batch
+                    try:
+                        received = decoder.feed(data)
+                    except ValueError as e: # also covers a malformed hello
+                        print(f"[receive_from_peer] decode error: {e}")
+                        return
+                    self.handle_messages(self.accept_messages(peer_id, received), peer_id)
             except Exception as e:
                 print(f"[receive_from_peer] error: {e}")
             finally:
-                # we need this "if" check since the broadcast thread may have deleted that already
-                with self.lock:
-                    if peer_id in self.peers:
-                        del self.peers[peer_id]
+                self.remove_peer(peer_id)
+
+    def accept_messages(self, peer_id, received):
+        """
+        Checks a peer's hello and drops what request mode ignores. Returns
+        the messages that should be handled. Raises ValueError for a peer
+        that doesn't speak our codec.
+        """
+        msgs = []
+        for msg in received:
+            if msg["type"] == "hello":
+                if negotiate(msg.get("codecs", [])) is None:
+                    raise ValueError(f"{peer_id} doesn't speak {BINARY}")
+                if "port" in msg:
+                    self.peer_addresses[peer_id] = f"{peer_id.split(':')[0]}:{msg['port']}"
+                    self.drop_duplicate_link(self.peer_addresses[peer_id])
+            elif self.request_mode:
+                if msg["type"] in SYNC_TYPES:
+                    msgs.append(msg)
+            else:
+                msgs.append(msg)
+        return msgs
+
+    def remove_peer(self, peer_id):
+        """
+        Forgets a peer whose connection closed. A closed outbound link is
+        replaced in overlay mode.
+        """
+        # we need this "if" check since the broadcast thread may have deleted that already
+        with self.lock:
+            if peer_id in self.peers:
+                del self.peers[peer_id]
+            self.peer_addresses.pop(peer_id, None)
+            queue = self.outbound.pop(peer_id, None)
+            was_dialed = peer_id in self.dialed
+            self.dialed.discard(peer_id)
+        if queue is not None:
+            queue.close()
+        self.rpc.fail_peer(peer_id)
+        if was_dialed and self.outbound_links is not None:
+            self.fill_links()
     
-    def handle_message(self, msg):
+    def handle_messages(self, msgs, peer_id=None):
+        """
+        Handle a group of messages received together, in order.
+        Consecutive transactions are passed to handle_transactions() as one batch,
+        everything else goes through handle_message().
+        """
+        batch = []
+        for msg in msgs:
+            if msg["type"] == "transaction":
+                batch.append((msg["transaction"], msg["signature"]))
+                continue
+            if batch:
+                self.handle_transactions(batch, peer_id)
+                batch = []
+            self.handle_message(msg, peer_id)
+        if len(batch) == 1:
+            self.handle_transaction(*batch[0], peer_id)
+        elif batch:
+            self.handle_transactions(batch, peer_id)
+
+    def handle_message(self, msg, peer_id=None):
         """
         Handle the message received from peers.
         Calls handle_block() or handle_transaction() depending on the type of message, as set by the message protocol.
+        Messages arrive already decoded by the FrameDecoder. peer_id is the
+        sender, which sync replies are sent back to.
         """
         print(self.wallet.name + " received a message of type " + msg["type"])
         if msg["type"] == "transaction":
-            tx_bytes = base64.b64decode(msg["data"])
-            tx = pickle.loads(tx_bytes)
-            sign = msg["signature"]
-            self.handle_transaction(tx, sign)
+            self.handle_transaction(msg["transaction"], msg["signature"], peer_id)
         elif msg["type"] == "block":
-            block_bytes = base64.b64decode(msg["data"])
-            block = pickle.loads(block_bytes)
-            self.handle_block(block)
-        elif msg["type"] == "chain":
-            chain = pickle.loads(base64.b64decode(msg["chain"]))
-            received_balances = pickle.loads(base64.b64decode(msg["balances"]))
-            received_mempool = pickle.loads(base64.b64decode(msg["mempool"]))
-            self.handle_chain(chain, received_balances, received_mempool)
-        elif msg["type"] == "request":
-            self.send_chain()
-
-    def handle_chain(self, chain, received_balances, received_mempool):
-        """
-        Handle a chain received from another peer.
-        Keeps track of the longest chain received, and updates balances and mempool once all chains have been received.
-        """
-        print(f"[handle_chain] {self.wallet.name} received a chain")
-        with self.lock:
-            if len(chain) > self.longest_chain_length:
-                self.longest_chain = chain
-                self.longest_chain_length = len(chain)
-                self.received_balances = received_balances
-                self.received_mempool = received_mempool
-            self.requests += 1
-            if self.requests == len(self.peers) - 1:
-                self.chain.chain = self.longest_chain
+            self.handle_block(msg["block"], peer_id)
+        elif msg["type"] == "inv":
+            self.handle_inv(msg["items"], peer_id)
+        elif msg["type"] == "getdata":
+            self.handle_getdata(msg["items"], peer_id)
+        elif msg["type"] == "getaddr":
+            self.handle_getaddr(peer_id)
+        elif msg["type"] == "addr":
+            self.handle_addr(msg["entries"], peer_id)
+        elif msg["type"] == "getheaders":
+            self.handle_getheaders(msg["locator"], peer_id, msg.get("id", 0))
+        elif msg["type"] == "headers":
+            self.handle_headers(msg["headers"], peer_id, msg.get("id", 0))
+        elif msg["type"] == "getblocks":
+            self.handle_getblocks(msg["hashes"], peer_id, msg.get("id", 0))
+        elif msg["type"] == "blocks":
+            self.handle_blocks(msg["blocks"], peer_id, msg.get("id", 0))
+
+    def handle_getheaders(self, locator, peer_id, request_id=0):
+        """
+        Answers a sync request: finds where the requester's chain splits from
+        ours using its locator and sends back the headers after that point.
+        """
+        with self.lock:
+            fork_height = self.chain.fork_point(locator[:MAX_LOCATOR])
+            headers = self.chain.headers_after(fork_height, MAX_HEADERS)
+        self.send_to(peer_id, {"type": "headers", "headers": headers, "id": request_id})
+
+    def handle_headers(self, headers, peer_id, request_id=0):
+        """
+        Handle the headers a peer sent after our fork point. They are linked
+        and checked for proof of work before the branch is considered.
+        """
+        print(f"[handle_headers] {self.wallet.name} received {len(headers)} headers")
+        with self.lock:
+            if not self.sync_reply(request_id, peer_id, "headers"):
+                return
+            fork_height = self.chain.block_heights.get(headers[0].prev_hash, -1) if headers else -1
+            self.offer_candidate(peer_id, fork_height, headers)
+
+    def sync_reply(self, request_id, peer_id, reply):
+        """
+        Whether a reply answers a request of the current sync round. Replies
+        that come late, unasked or from another peer are dropped. Called
+        under the lock.
+        """
+        if request_id not in self.sync_requests:
+            return False
+        if self.rpc.resolve(request_id, peer_id, reply) is None:
+            return False
+        self.sync_requests.discard(request_id)
+        return True
+
+    def sync_request_failed(self, request):
+        """
+        A peer didn't answer its sync request in time or disconnected; the
+        round goes on without it.
+        """
+        with self.lock:
+            if request.request_id not in self.sync_requests:
+                return
+            self.sync_requests.discard(request.request_id)
+            self.check_sync_round()
+
+    def offer_candidate(self, peer_id, fork_height, headers):
+        """
+        Counts one sync reply and keeps it as the best candidate if it makes
+        the valid chain with the most work so far, the same rule
+        Chain.accept_block() switches branches by.
+        """
+        if headers and fork_height >= 0 and self.chain.check_headers(fork_height, headers):
+            # a fork below a snapshot's block can't be reorganized to
+            fork = self.chain.tree.get(self.chain.hash_at(fork_height))
+            if fork is not None:
+                work = fork.work + sum(block_work(header) for header in headers)
+                best_work = self.best_candidate[0] if self.best_candidate else self.chain.tree.get(self.chain.tip_hash).work
+                if work > best_work:
+                    self.best_candidate = (work, peer_id, fork_height, headers)
+        self.sync_replies += 1
+        self.check_sync_round()
+
+    def check_sync_round(self):
+        """
+        Ends the sync round once sync_needed peers replied or every request
+        was answered or failed, so unresponsive peers only cost the timeout.
+        Requests still outstanding are given up.
+        """
+        if self.sync_replies < self.sync_needed and self.sync_requests:
+            return
+        self.rpc.cancel(self.sync_requests)
+        self.sync_requests = set()
+        self.finish_sync_round()
+
+    def finish_sync_round(self):
+        """
+        Called once enough sync replies are in. Fetches the bodies of the best
+        branch from the peer that offered it, or leaves request mode if no
+        peer had a longer chain.
+        """
+        if self.best_candidate is None:
+            print(f"[finish_sync_round] {self.wallet.name} chain is up to date ({self.sync_replies} replies)")
+            self.request_mode = False
+            return
+        _, peer_id, fork_height, headers = self.best_candidate
+        self.blocks_received = 0
+        print(f"[finish_sync_round] {self.wallet.name} fetching {len(headers)} blocks from {peer_id}")
+        self.request_blocks(peer_id, headers)
+
+    def request_blocks(self, peer_id, headers):
+        """
+        Asks a peer for the bodies of the given headers.
+        """
+        self.blocks_request = self.rpc.start(peer_id, "blocks", self.blocks_request_failed, self.sync_timeout)
+        self.send_to(peer_id, {"type": "getblocks", "hashes": [header.hash for header in headers],
+                               "id": self.blocks_request})
+
+    def blocks_request_failed(self, request):
+        """
+        The peer with the best branch didn't send its blocks. Request mode
+        ends, so the next unknown block starts a new round.
+        """
+        with self.lock:
+            if request.request_id != self.blocks_request:
+                return
+            print(f"[blocks_request_failed] {self.wallet.name} {request.peer_id} didn't send the blocks")
+            self.blocks_request = None
+            self.best_candidate = None
+            self.request_mode = False
+
+    def handle_getblocks(self, hashes, peer_id, request_id=0):
+        """
+        Sends the requested blocks of our chain back to a syncing peer, as
+        many as fit in MAX_BLOCKS_BYTES. The peer asks again for the rest.
+        At most MAX_HEADERS hashes are looked at, the most a sync asks for.
+        """
+        with self.lock:
+            blocks = self.chain.blocks_by_hash(hashes[:MAX_HEADERS], MAX_BLOCKS_BYTES)
+        self.send_to(peer_id, {"type": "blocks", "blocks": blocks, "id": request_id})
+
+    def handle_blocks(self, blocks, peer_id, request_id=0):
+        """
+        Handle the block bodies of the branch chosen by finish_sync_round().
+        """
+        print(f"[handle_blocks] {self.wallet.name} received {len(blocks)} blocks")
+        with self.lock:
+            if request_id != self.blocks_request or self.rpc.resolve(request_id, peer_id, "blocks") is None:
+                return
+            self.blocks_request = None
+        self.chain.verify_blocks(blocks)
+        with self.lock:
+            if not self.request_mode or self.best_candidate is None:
+                return
+            _, _, fork_height, headers = self.best_candidate
+            self.apply_branch(fork_height, headers, blocks)
+
+    def apply_branch(self, fork_height, headers, blocks):
+        """
+        Adds the next blocks of the synced branch if they match the headers
+        that were checked. A "blocks" reply only holds what fits in one
+        frame, so the rest is asked for until the branch is complete; the
+        chain switches once it is heavier. A full batch of headers means the
+        peer has more, so another sync round starts from the new tip.
+        """
+        expected = headers[self.blocks_received:self.blocks_received + len(blocks)]
+        if (not blocks or len(blocks) != len(expected)
+                or any(block.hash != header.hash for block, header in zip(blocks, expected))):
+            print(f"[apply_branch] {self.wallet.name} blocks don't match their headers, discarding")
+            self.best_candidate = None
+            self.request_mode = False
+            return
+        for block in blocks:
+            if self.chain.accept_block(block) == "invalid":
+                print(f"[apply_branch] {self.wallet.name} branch has an invalid block, discarding")
+                self.best_candidate = None
                 self.request_mode = False
-                self.requests = 0
-                self.longest_chain_length = 0
-                self.chain.balances = self.received_balances
-                self.chain.mempool = self.received_mempool
+                return
+        self.blocks_received += len(blocks)
+        if self.blocks_received < len(headers):
+            self.request_blocks(self.best_candidate[1], headers[self.blocks_received:])
+            return
+        self.best_candidate = None
+        print(f"[apply_branch] {self.wallet.name} synced to height {len(self.chain.chain) - 1}")
+        self.request_mode = False
+        if len(headers) >= MAX_HEADERS:
+            self.request_chains()
+
+    def handle_inv(self, items, peer_id):
+        """
+        Handle a peer announcing transactions and blocks by hash. Only the
+        ones we haven't seen, don't have and aren't already waiting for are
+        asked for with a "getdata".
+        """
+        now = time.monotonic()
+        wanted = []
+        with self.lock:
+            for kind, item_hash in items:
+                item = (kind, item_hash)
+                if item in self.seen or self.has_item(kind, item_hash):
+                    continue
+                asked = self.requested.get(item)
+                if asked is not None and now - asked < REQUEST_TIMEOUT:
+                    continue
+                self.requested.put(item, now)
+                wanted.append(item)
+        if wanted:
+            self.send_to(peer_id, {"type": "getdata", "items": wanted})
+
+    def has_item(self, kind, item_hash):
+        """
+        Whether a transaction (by txid) or block (by hash) is already known.
+        """
+        if kind == "tx":
+            return self.chain.has_transaction(item_hash)
+        return item_hash in self.chain.tree or item_hash in self.chain.tree.orphans
+
+    def handle_getdata(self, items, peer_id):
+        """
+        Sends the bodies of the announced items a peer asked for.
+        """
+        msgs = []
+        with self.lock:
+            for kind, item_hash in items:
+                if kind == "tx":
+                    entry = self.chain.mempool.get(item_hash)
+                    if entry is not None:
+                        msgs.append({"type": "transaction", "transaction": entry[0], "signature": entry[1]})
+                else:
+                    block = self.chain.get_block(item_hash)
+                    if block is not None:
+                        msgs.append({"type": "block", "block": block})
+        for msg in msgs:
+            self.send_to(peer_id, msg)
+
+    def announce(self, items, exclude=None):
+        """
+        Tells peers about new transactions or blocks, given as (kind, hash)
+        items. Every peer gets one "inv" with just the hashes and fetches the
+        bodies it needs. exclude is the peer the items came from.
+        """
+        for item in items:
+            self.seen.put(item, True)
+        inv = encode({"type": "inv", "items": items})
+        with self.lock:
+            queues = [queue for peer_id, queue in self.outbound.items() if peer_id != exclude]
+        for queue in queues:
+            queue.put(inv)
 
-    def handle_block(self, block):
+    def own_entry(self):
+        """
+        Our (listen address, public key, name) peer exchange entry.
+        """
+        return (f"127.0.0.1:{self.port}", self.wallet.public_key, self.wallet.name)
+
+    def handle_getaddr(self, peer_id):
+        """
+        Answers with our own entry and up to ADDR_SAMPLE - 1 random ones
+        from the address book. Entries the tracker gave us are checked too,
+        one bad key would make the whole reply fail to encode.
+        """
+        with self.lock:
+            entries = [(address, public_key, self.peer_name_map.get(public_key, ""))
+                       for address, public_key in self.address_book.items() if public_key is not None]
+        entries = [entry for entry in entries if valid_entry(*entry)]
+        if len(entries) > ADDR_SAMPLE - 1:
+            entries = random.sample(entries, ADDR_SAMPLE - 1)
+        self.send_to(peer_id, {"type": "addr", "entries": [self.own_entry()] + entries})
+
+    def handle_addr(self, entries, peer_id):
+        """
+        Adds peer exchange entries to the address book and names. A single
+        entry is a peer announcing itself (or a relay of that): if it is
+        new to us, it is passed on to ADDR_RELAY random links, so it spreads
+        through the network and stops where it is already known. New
+        addresses may also fill free overlay links. Malformed entries are
+        dropped, and names only fill gaps: the tracker's names always win.
+        """
+        learned = []
+        with self.lock:
+            for address, public_key, name in entries[:ADDR_SAMPLE]:
+                if address == f"127.0.0.1:{self.port}" or not valid_entry(address, public_key, name):
+                    continue
+                if self.address_book.get(address) != public_key:
+                    learned.append((address, public_key, name))
+                self.remember_address(address, public_key)
+                self.peer_name_map.setdefault(public_key, name)
+            others = [other for other in self.peers if other != peer_id]
+        if not learned:
+            return
+        if len(entries) == 1:
+            for other in random.sample(others, min(ADDR_RELAY, len(others))):
+                self.send_to(other, {"type": "addr", "entries": learned})
+        self.fill_links()
+
+    def remember_address(self, address, public_key):
+        """
+        Adds or updates an address book entry. Beyond MAX_ADDRESSES the
+        oldest addresses we are not linked to are forgotten. Called under
+        the lock.
+        """
+        self.address_book.pop(address, None)
+        self.address_book[address] = public_key
+        if len(self.address_book) <= MAX_ADDRESSES:
+            return
+        linked = set(self.peers) | set(self.peer_addresses.values()) | self.dialed | {address}
+        for old in list(self.address_book):
+            if old not in linked:
+                del self.address_book[old]
+                if len(self.address_book) <= MAX_ADDRESSES:
+                    return
+
+    def refresh_addresses(self):
+        """
+        Keeps the address book warm without the tracker: asks a random link
+        for its address book and fills free overlay links.
+        """
+        with self.lock:
+            peer_ids = list(self.peers)
+        if peer_ids:
+            self.send_to(random.choice(peer_ids), {"type": "getaddr"})
+        self.fill_links()
+
+    def address_thread(self):
+        """
+        Calls refresh_addresses() every ADDR_INTERVAL seconds.
+        """
+        while True:
+            time.sleep(ADDR_INTERVAL)
+            self.refresh_addresses()
+
+    def handle_block(self, block, peer_id=None):
         """
         Handle a block received from another peer after it successfully mines it.
         Need to call chain.update_balance()
         Need to handle forks
+        A block that became our tip is announced on to the other peers.
+        Only a block that wasn't rejected counts as seen: a malformed copy
+        can have the hash of the real block, which must still be fetched.
+        Known blocks and blocks failing the cheap check_block() (proof of
+        work, size, reward) are dropped before any signature is verified.
         """
         with self.lock:
-            if block.prev_hash == self.chain.chain[-1].hash:
-                self.chain.add_block(block)
-                print(f"[handle_block] {self.wallet.name} block {block.hash[:8]} added to chain")
-            elif not block.hash.startswith("0000"):
-                print(f"[handle_block] Invalid block detected! Discarding block.")
-            else:
-                print(f"[handle_block] Fork detected!")
-                self.request_chains()
+            known = block.hash in self.chain.tree or block.hash in self.chain.tree.orphans
+        if known:
+            self.seen.put(("block", block.hash), True)
+            return
+        error = self.chain.check_block(block)
+        if error is not None:
+            print(f"[handle_block] block {block.hash[:8]} rejected: {error}")
+            self.requested.pop(("block", block.hash))
+            return
+        # stop our search right away if this block beats us to the current
+        # tip, instead of after it has been verified and added
+        if block.prev_hash == self.chain.tip_hash:
+            self.chain.cancel_mining()
+        self.chain.verify_blocks([block])
+        with self.lock:
+            result = self.chain.accept_block(block)
+        if result == "invalid":
+            self.requested.pop(("block", block.hash))
+        else:
+            self.seen.put(("block", block.hash), True)
+        if result in ("extended", "reorganized"):
+            self.scheduler.notify()
+            self.announce([("block", block.hash)], exclude=peer_id)
+        if result == "extended":
+            print(f"[handle_block] {self.wallet.name} block {block.hash[:8]} added to chain")
+        elif result == "reorganized":
+            print(f"[handle_block] {self.wallet.name} switched to heavier branch ending in {block.hash[:8]}")
+        elif result == "side":
+            print(f"[handle_block] {self.wallet.name} block {block.hash[:8]} stored on a side branch")
+        elif result == "invalid":
+            print(f"[handle_block] Invalid block detected! Discarding block.")
+        elif result == "orphan":
+            print(f"[handle_block] Fork detected! Parent of {block.hash[:8]} unknown, syncing")
+            self.request_chains()
 
-    def handle_transaction(self, transaction, sign):
+    def handle_transaction(self, transaction, sign, peer_id=None):
         """
         Handle a transaction received from another peer.
         Need to call chain.recv_transaction()
+        A transaction that entered the mempool is announced on to the other peers.
+        The txid doesn't cover the signature, so it only counts as seen once
+        the signature checked out; a copy with a bad one doesn't keep the
+        real transaction from being fetched.
         """
         print(f"[handle_transaction] {self.wallet.name} received a transaction")
+        if not verify_transaction(transaction, sign):
+            print("Invalid signature, transaction rejected.")
+            self.requested.pop(("tx", transaction.txid))
+            return
+        self.seen.put(("tx", transaction.txid), True)
         with self.lock:
-            self.chain.recv_transaction(transaction, sign, True)
+            success, _ = self.chain.recv_transaction(transaction, sign, True)
+        if success:
+            self.scheduler.notify()
+            self.announce([("tx", transaction.txid)], exclude=peer_id)
     
+    def handle_transactions(self, batch, peer_id=None):
+        """
+        Handle a batch of (transaction, signature) pairs received from peers.
+        The signatures are checked before taking the lock, spread over worker
+        processes for large batches, then the batch is added to the mempool
+        under a single lock acquisition. Like in handle_transaction(), only
+        transactions with a valid signature count as seen.
+        """
+        print(f"[handle_transactions] {self.wallet.name} received {len(batch)} transactions")
+        valid = []
+        for pair, ok in zip(batch, verify_transactions(batch)):
+            if ok:
+                self.seen.put(("tx", pair[0].txid), True)
+                valid.append(pair)
+            else:
+                self.requested.pop(("tx", pair[0].txid))
+        batch = valid
+        with self.lock:
+            results = self.chain.recv_transactions(batch, True)
+        admitted = [("tx", transaction.txid) for (transaction, _), (success, _) in zip(batch, results) if success]
+        if admitted:
+            self.scheduler.notify()
+            self.announce(admitted, exclude=peer_id)
+
     def broadcast(self, msg):
         """
         Broadcast a message to all peers in the network.
         This message may be a new transaction or a new block mined.
+        The message is encoded once and only queued for each peer's writer
+        thread, so broadcast never waits on the network.
         """
-        msg_str = json.dumps(msg) + "\n"
-        with self.lock:
-            for peer_id, conn in self.peers.items():
-                try:
-                    conn.sendall(msg_str.encode())
-                except Exception as e:
-                    print(f"[broadcast] error: {e}")
-                    conn.close()
-                    # we need this "if" check since the listener thread may have deleted that already
-                    if peer_id in self.peers:
-                        del self.peers[peer_id]
+        encoded = encode(msg)
+        with self.lock:
+            queues = list(self.outbound.values())
+        for queue in queues:
+            queue.put(encoded)
     
+    def send_to(self, peer_id, msg):
+        """
+        Queue a message to a single peer. A message too large for one frame
+        is not sent.
+        """
+        with self.lock:
+            queue = self.outbound.get(peer_id)
+        if queue is None:
+            return
+        try:
+            queue.put(encode(msg))
+        except ValueError as e:
+            print(f"[send_to] not sending to {peer_id}: {e}")
+
     def request_chains(self):
         """
-        Broadcast a message to all peers in the network requesting for chains.
+        Ask every peer where its chain goes past ours. Peers get our block
+        locator in a "getheaders" and answer with headers from the fork
+        point on, so only the part that differs is transferred.
+        Every request carries its own id and times out after sync_timeout
+        seconds, see check_sync_round().
         """
         print("[request_chains] fork detected, requesting chains from peers")
         with self.lock:
+            if self.request_mode or not self.peers:
+                return
             self.request_mode = True
-            self.requests_needed = len(self.peers)
-            msg = {
-                "type": "request"
-            }
-            self.broadcast(msg)
-        
-    def send_chain(self):
-        """
-        Sends this peer's current blockchain to all requesting peers.
-        """
-        print(f"[send_chain] {self.wallet.name} Sending chain to all peers")
-        pickled_chain = pickle.dumps(self.chain.chain)
-        # Encode the bytes into a JSON-safe string
-        encoded_chain = base64.b64encode(pickled_chain).decode('utf-8')
-
-        pickled_mempool = pickle.dumps(self.chain.mempool)
-        encoded_mempool = base64.b64encode(pickled_mempool).decode('utf-8')
-
-        pickled_balances = pickle.dumps(self.chain.balances)
-        encoded_balances = base64.b64encode(pickled_balances).decode('utf-8')
-        msg = {
-            "type": "chain",
-            "chain": encoded_chain,
-            "mempool": encoded_mempool,
-            "balances": encoded_balances
-        }
-        self.broadcast(msg)
+            self.best_candidate = None
+            self.blocks_request = None
+            self.sync_replies = 0
+            self.sync_needed = len(self.peers) if self.sync_quorum is None else min(self.sync_quorum, len(self.peers))
+            self.sync_requests = set()
+            locator = self.chain.locator()
+            for peer_id in list(self.peers):
+                request_id = self.rpc.start(peer_id, "headers", self.sync_request_failed, self.sync_timeout)
+                self.sync_requests.add(request_id)
+                self.send_to(peer_id, {"type": "getheaders", "locator": locator, "id": request_id})
 
     def transfer(self, receiver_public_key: str, amount: float):
         """
         Creating a transaction to send money to another peer.
-        Calls broadcast() to announce the transaction to all peers.
+        Calls announce() to tell all peers about the transaction.
         """
         transaction = Transaction(amount, self.wallet, receiver_public_key)
         sign = self.wallet.sign(transaction)
-        pickled_transaction = pickle.dumps(transaction)
-        # Encode the bytes into a JSON-safe string
-        encoded_transaction = base64.b64encode(pickled_transaction).decode('utf-8')
-        message = {
-            "type": "transaction",
-            "signature": sign,
-            "data": encoded_transaction
-        }
-        success, status = self.wallet.send_money(amount, receiver_public_key, self.chain)
+        # admit the same transaction that gets announced, so every peer
+        # knows it under one txid. The signature is checked before the lock,
+        # recv_transaction then finds it in the cache
+        verify_transaction(transaction, sign)
+        with self.lock:
+            success, status = self.chain.recv_transaction(transaction, sign, False)
         if success:
-            self.broadcast(message)
+            self.scheduler.notify()
+            self.announce([("tx", transaction.txid)])
             receiver_name = self.peer_name_map.get(receiver_public_key, receiver_public_key)
             print(f"[transfer] {self.wallet.name} sent {amount} to {receiver_name}")
             return True
@@ -297,27 +1030,30 @@ class Peer:
     def mine_block(self):
         """
         Mine a block using the transactions in the mempool.
-        Need to call chain.mine_block() and broadcast the block to peers.
-        Need to handle the case where a block is received from another peer, since it mined it first. 
+        The block is prepared under the lock, but the proof of work runs
+        without it, so blocks and transactions from peers are handled while
+        we mine and a competing block stops the search right away. The lock
+        is taken again only to add the block, if it still extends our tip.
+        Returns the block, or None if none was added.
         """
         with self.lock:
-            block = self.chain.mine_block(self.wallet)
-            if block == False:
-                print("[mine_block] New block already added by peer. Aborting own block.")
-                return
-            if block:
-                self.chain.add_block(block)
-        
-        if block:
-            pickled_block = pickle.dumps(block)
-            # Encode the bytes into a JSON-safe string
-            encoded_block = base64.b64encode(pickled_block).decode('utf-8')
-            message = {
-                "type": "block",
-                "data": encoded_block
-            }
-            print("Broadcasting block: " + block.hash[:8])
-            self.broadcast(message)
+            if self.request_mode:
+                return None
+            block = self.chain.prepare_block(self.wallet)
+        if not self.chain.search_block(block):
+            print("[mine_block] New block already added by peer. Aborting own block.")
+            return None
+        with self.lock:
+            if block.prev_hash != self.chain.tip_hash or self.request_mode:
+                print("[mine_block] Tip moved while mining. Aborting own block.")
+                return None
+            self.chain.add_block(block)
+        worker_rates = ", ".join(f"{rate:.0f}" for rate in self.chain.miner.worker_hashrates)
+        print(f"{self.wallet.name} Block mined! ({self.chain.miner.hashrate:.0f} H/s, per worker: {worker_rates})")
+
+        print("Broadcasting block: " + block.hash[:8])
+        self.announce([("block", block.hash)])
+        return block
 
     def list_users(self):
         """
@@ -341,12 +1077,14 @@ class Peer:
         """
         Entry point to start the peer node.
         """
-        self.connect_to_tracker()
-        self.form_peer_connections()
+        # listen before the tracker announces us, so peers can connect right away
         threading.Thread(target=self.listener_thread, daemon=True).start()
-        threading.Thread(target=self.tracker_thread, daemon=True).start()
-        
-        # Collects transaction from mempool to mine a block every 10 seconds
-        while True:
-            time.sleep(10)
-            self.mine_block()
\ No newline at end of file
+        if self.tracker_addr is not None:
+            self.connect_to_tracker()
+        self.form_peer_connections()
+        if self.socket_to_tracker is not None:
+            threading.Thread(target=self.tracker_thread, daemon=True).start()
+        threading.Thread(target=self.address_thread, daemon=True).start()
+
+        # mines whenever the mining policy says so, see network/scheduler.py
+        self.scheduler.run()
\ No newline at end of file
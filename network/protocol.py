@@ -0,0 +1,164 @@
+import json
+import struct
+from blockchain import codec
+
+# Every connection starts with a JSON "hello" line listing the encodings a
+# peer understands, which must include ours. Everything after it is binary
+# frames.
+BINARY = "bin4"
+SUPPORTED_CODECS = [BINARY] # in order of preference
+
+MAGIC = 0x00
+_FRAME = struct.Struct(">BBBI") # magic, codec version, message type, payload length
+MAX_FRAME_BYTES = 32 * 1024 * 1024 # largest payload sent or accepted
+MAX_HELLO_BYTES = 4096 # longest hello line accepted
+
+# message type codes of binary frames. 3 and 4 were the full chain
+# "chain"/"request" pair, replaced by headers-first sync; don't reuse them
+_TYPE_CODES = {"transaction": 1, "block": 2,
+               "getheaders": 5, "headers": 6, "getblocks": 7, "blocks": 8,
+               "inv": 9, "getdata": 10, "getaddr": 11, "addr": 12}
+_TYPE_NAMES = {code: name for name, code in _TYPE_CODES.items()}
+# requests and their replies carry a correlation id, see network/rpc.py
+RPC_TYPES = {"getheaders", "headers", "getblocks", "blocks"}
+
+def hello_message(port: int = None) -> bytes:
+    """
+        The handshake line sent first on every connection. port is the one
+        we listen on, so a peer we connected to knows our address.
+    """
+    hello = {"type": "hello", "codecs": SUPPORTED_CODECS}
+    if port is not None:
+        hello["port"] = port
+    return (json.dumps(hello) + "\n").encode()
+
+def negotiate(codecs: list) -> str:
+    """
+        Picks the encoding to use with a peer from the codecs in its hello,
+        or None if we share none and the peer has to be dropped.
+    """
+    for name in SUPPORTED_CODECS:
+        if name in codecs:
+            return name
+    return None
+
+def _encode_payload(msg: dict) -> bytes:
+    kind = msg["type"]
+    if kind in RPC_TYPES:
+        return codec.write_varint(msg.get("id", 0)) + _encode_body(msg)
+    return _encode_body(msg)
+
+def _encode_body(msg: dict) -> bytes:
+    kind = msg["type"]
+    if kind == "transaction":
+        return codec.encode_transaction(msg["transaction"], msg["signature"])
+    if kind == "block":
+        return codec.encode_block(msg["block"])
+    if kind == "getheaders":
+        return codec.encode_hashes(msg["locator"])
+    if kind == "headers":
+        return codec.encode_headers(msg["headers"])
+    if kind == "getblocks":
+        return codec.encode_hashes(msg["hashes"])
+    if kind == "blocks":
+        return codec.encode_blocks(msg["blocks"])
+    if kind in ("inv", "getdata"):
+        return codec.encode_inventory(msg["items"])
+    if kind == "addr":
+        return codec.encode_addresses(msg["entries"])
+    return b""
+
+def _decode_payload(kind: str, payload: bytes) -> dict:
+    """
+        Decodes a frame's payload. The codec reads fields without checking
+        the length first, so a truncated or garbled payload fails with
+        struct.error or IndexError; those are raised as ValueError.
+    """
+    try:
+        return _decode_rpc(kind, payload)
+    except (struct.error, IndexError, OverflowError) as e:
+        raise ValueError(f"malformed {kind} message: {e}") from e
+
+def _decode_rpc(kind: str, payload: bytes) -> dict:
+    if kind in RPC_TYPES:
+        request_id, offset = codec.read_varint(payload, 0)
+        msg = _decode_body(kind, payload[offset:])
+        msg["id"] = request_id
+        return msg
+    return _decode_body(kind, payload)
+
+def _decode_body(kind: str, payload: bytes) -> dict:
+    if kind == "transaction":
+        (transaction, sign), _ = codec.decode_transaction(payload)
+        return {"type": kind, "transaction": transaction, "signature": sign}
+    if kind == "block":
+        block, _ = codec.decode_block(payload)
+        return {"type": kind, "block": block}
+    if kind == "getheaders":
+        return {"type": kind, "locator": codec.decode_hashes(payload)[0]}
+    if kind == "headers":
+        return {"type": kind, "headers": codec.decode_headers(payload)[0]}
+    if kind == "getblocks":
+        return {"type": kind, "hashes": codec.decode_hashes(payload)[0]}
+    if kind == "blocks":
+        return {"type": kind, "blocks": codec.decode_blocks(payload)[0]}
+    if kind in ("inv", "getdata"):
+        return {"type": kind, "items": codec.decode_inventory(payload)[0]}
+    if kind == "addr":
+        return {"type": kind, "entries": codec.decode_addresses(payload)[0]}
+    return {"type": kind}
+
+def encode(msg: dict) -> bytes:
+    """
+        Encodes a message as a binary frame. Raises ValueError if it is
+        larger than MAX_FRAME_BYTES, which no peer would accept.
+    """
+    payload = _encode_payload(msg)
+    if len(payload) > MAX_FRAME_BYTES:
+        raise ValueError(f"{msg['type']} message of {len(payload)} bytes is too large")
+    return _FRAME.pack(MAGIC, codec.CODEC_VERSION, _TYPE_CODES[msg["type"]], len(payload)) + payload
+
+class FrameDecoder:
+    """
+        Splits a byte stream into messages: the JSON hello line first, then
+        binary frames only. A frame header is checked as soon as it arrives,
+        so a peer can't make us buffer more than MAX_FRAME_BYTES.
+    """
+    def __init__(self):
+        """
+            greeted: whether the hello line was read
+        """
+        self.buffer = bytearray()
+        self.greeted = False
+
+    def feed(self, data: bytes) -> list:
+        """
+            Adds received bytes and returns every message completed by them.
+            Raises ValueError on a malformed message.
+        """
+        self.buffer += data
+        msgs = []
+        if not self.greeted:
+            end = self.buffer.find(b"\n", 0, MAX_HELLO_BYTES)
+            if end < 0:
+                if len(self.buffer) >= MAX_HELLO_BYTES:
+                    raise ValueError("no hello line")
+                return msgs
+            hello = json.loads(bytes(self.buffer[:end]))
+            if not isinstance(hello, dict) or hello.get("type") != "hello":
+                raise ValueError("connection doesn't start with a hello")
+            del self.buffer[:end + 1]
+            self.greeted = True
+            msgs.append(hello)
+        while len(self.buffer) >= _FRAME.size:
+            magic, version, code, length = _FRAME.unpack_from(self.buffer)
+            if magic != MAGIC or version != codec.CODEC_VERSION or code not in _TYPE_NAMES:
+                raise ValueError(f"unknown frame {magic} version {version} / type {code}")
+            if length > MAX_FRAME_BYTES:
+                raise ValueError(f"frame of {length} bytes is too large")
+            if len(self.buffer) < _FRAME.size + length:
+                break
+            payload = bytes(self.buffer[_FRAME.size:_FRAME.size + length])
+            del self.buffer[:_FRAME.size + length]
+            msgs.append(_decode_payload(_TYPE_NAMES[code], payload))
+        return msgs
@@ -0,0 +1,127 @@
+import heapq
+import itertools
+import threading
+import time
+
+class TimeoutQueue:
+    """
+        One daemon thread that fires the timeouts of every RequestTracker in
+        the process, earliest deadline first from a heap, instead of a
+        threading.Timer (and so a thread) per request. Entries are never
+        removed early: a callback for a request that was answered meanwhile
+        finds nothing pending and does nothing.
+    """
+    def __init__(self):
+        self._heap = [] # (deadline, sequence number, callback, args)
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay: float, callback, args: tuple):
+        """
+            Calls callback(*args) from the timeout thread after delay seconds.
+        """
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._order), callback, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="rpc-timeouts")
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, callback, args = heapq.heappop(self._heap)
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"[rpc] timeout callback error: {e}")
+
+_timeouts = TimeoutQueue()
+
+class Request:
+    """
+        One outstanding request to a peer.
+    """
+    def __init__(self, request_id: int, peer_id: str, reply: str, on_failure):
+        """
+            reply: the message type that answers it, e.g. "headers"
+            on_failure: called with the Request if it times out or the peer
+                        disconnects first
+        """
+        self.request_id = request_id
+        self.peer_id = peer_id
+        self.reply = reply
+        self.on_failure = on_failure
+
+class RequestTracker:
+    """
+        Outstanding requests to peers by correlation id. Every request gets
+        a fresh id, which the reply carries back, and a deadline in the
+        shared TimeoutQueue. A reply that
+        comes late, from another peer or for a request we gave up on matches
+        nothing and is dropped; a request without a reply fails on timeout.
+        The id 0 is never used, it marks messages that answer nothing.
+    """
+    def __init__(self, timeout: float):
+        """
+            timeout: default seconds to wait for a reply
+        """
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._pending = {} # {request id : Request}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self, peer_id: str, reply: str, on_failure, timeout: float = None) -> int:
+        """
+            Registers a request about to be sent and returns its id.
+        """
+        request_id = next(self._ids)
+        with self._lock:
+            self._pending[request_id] = Request(request_id, peer_id, reply, on_failure)
+        _timeouts.schedule(timeout if timeout is not None else self.timeout, self._expire, (request_id,))
+        return request_id
+
+    def resolve(self, request_id: int, peer_id: str, reply: str) -> Request:
+        """
+            Matches a reply to its request, which then can't time out.
+            Returns None if the reply doesn't answer an outstanding request.
+        """
+        with self._lock:
+            request = self._pending.get(request_id)
+            if request is None or request.peer_id != peer_id or request.reply != reply:
+                return None
+            del self._pending[request_id]
+        return request
+
+    def cancel(self, request_ids):
+        """
+            Gives up on requests whose replies aren't needed anymore.
+        """
+        with self._lock:
+            for request_id in request_ids:
+                self._pending.pop(request_id, None)
+
+    def fail_peer(self, peer_id: str):
+        """
+            Fails every request to a peer that disconnected, without waiting
+            for the timeouts.
+        """
+        with self._lock:
+            failed = [request for request in self._pending.values() if request.peer_id == peer_id]
+            for request in failed:
+                del self._pending[request.request_id]
+        for request in failed:
+            request.on_failure(request)
+
+    def _expire(self, request_id: int):
+        with self._lock:
+            request = self._pending.pop(request_id, None)
+        if request is not None:
+            print(f"[rpc] request {request_id} to {request.peer_id} got no {request.reply} in time")
+            request.on_failure(request)
@@ -0,0 +1,124 @@
+import random
+import threading
+import time
+
+class MiningPolicy:
+    """
+        When a node mines. Any rule that fires starts a mining round:
+            min_transactions: this many new transactions are pending (None
+                              to wait for the timers only)
+            max_wait: a pending transaction has waited this many seconds,
+                      even below min_transactions (None to only count)
+            idle_interval: the tip hasn't changed for this many seconds, so
+                           an empty block is mined for the reward and to
+                           keep blocks coming (None to never mine empty)
+        A block that was full is followed by another round right away.
+        With all three None the node never mines.
+            jitter: a round starts up to this many seconds after it is due,
+                    drawn anew for every tip. Every node sees the same
+                    transactions and tips at about the same time, so without
+                    it they would all mine at once and fork.
+    """
+    def __init__(self, min_transactions: int = 1, max_wait: float = 10.0, idle_interval: float = 10.0,
+                 jitter: float = 2.0):
+        self.min_transactions = min_transactions
+        self.max_wait = max_wait
+        self.idle_interval = idle_interval
+        self.jitter = jitter
+
+class MiningScheduler:
+    """
+        Runs mining rounds when the MiningPolicy says so, instead of on a
+        fixed timer. Peers call notify() when transactions arrive, the tip
+        changes or syncing starts or ends, and the scheduler thread wakes up
+        to reconsider. Nothing is mined while paused() is true.
+    """
+    def __init__(self, chain, mine, policy: MiningPolicy, paused=None):
+        """
+            chain: the Chain, read for its mempool size, tip and template
+            mine: runs one mining round, e.g. Peer.mine_block, returning
+                  None if no block was added
+            paused: returns True while mining should wait, e.g. when syncing
+            _leftover: mempool transactions our last block didn't take (they
+                       didn't fit its checks), not counted as new ones
+            _pending_since: when the oldest new transaction was first seen
+            _ready_since: when min_transactions was reached
+            _tip, _tip_since: the tip at the last check and since when
+            _delay: the jitter drawn for the current tip
+        """
+        self.chain = chain
+        self.mine = mine
+        self.policy = policy
+        self.paused = paused if paused is not None else (lambda: False)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._leftover = 0
+        self._pending_since = None
+        self._ready_since = None
+        self._tip = chain.tip_hash
+        self._tip_since = time.monotonic()
+        self._delay = random.uniform(0, policy.jitter)
+
+    def notify(self):
+        """
+            Something that may change the decision happened.
+        """
+        with self._cond:
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def next_round(self, now: float):
+        """
+            Seconds until the next mining round, 0 to mine now, or None to
+            wait for notify().
+        """
+        if self.paused():
+            return None
+        if self.chain.tip_hash != self._tip:
+            self._tip = self.chain.tip_hash
+            self._tip_since = now
+            self._delay = random.uniform(0, self.policy.jitter)
+        self._leftover = min(self._leftover, len(self.chain.mempool))
+        pending = len(self.chain.mempool) - self._leftover
+        if pending == 0:
+            self._pending_since = None
+        elif self._pending_since is None:
+            self._pending_since = now
+        deadlines = []
+        if self.policy.min_transactions is not None and pending >= self.policy.min_transactions:
+            if self._ready_since is None:
+                self._ready_since = now
+            deadlines.append(self._ready_since)
+        else:
+            self._ready_since = None
+        if pending and self.policy.max_wait is not None:
+            deadlines.append(self._pending_since + self.policy.max_wait)
+        if self.policy.idle_interval is not None:
+            deadlines.append(self._tip_since + self.policy.idle_interval)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) + self._delay - now)
+
+    def run(self):
+        """
+            Mines whenever a round is due, until stop(). Blocks the caller.
+        """
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    delay = self.next_round(time.monotonic())
+                    if delay == 0:
+                        break
+                    self._cond.wait(delay)
+                if self._stopped:
+                    return
+            if self.mine() is not None:
+                # what a full block couldn't take is mined next, what its
+                # checks left out waits for new transactions or blocks
+                self._leftover = 0 if self.chain.template.full else len(self.chain.mempool)
+                self._pending_since = None
+                self._ready_since = None
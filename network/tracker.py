@@ -1,124 +1,158 @@
 import argparse
-import socket
-import threading
+import asyncio
 import json
+import random
+
+MAX_TRACKER_BUFFER = 1024 * 1024 # bytes queued to a peer before it is dropped
 
 class Tracker:
     """
     Tracker class that manages a list of active peers.
+
+    It runs on one asyncio event loop, so a single process serves thousands
+    of peers without a thread each. Membership is versioned: a joining peer
+    gets the full member list once, then every join or leave is sent to all
+    peers as a small delta carrying the next version number.
     """
-    def __init__(self, host='0.0.0.0', port=8000):
+    def __init__(self, host='0.0.0.0', port=8000, sample_size=None):
+        """
+            sample_size: how many random peers a joining peer is given to
+                         connect to, None for all of them (full mesh)
+            peers: {peer_id : {'public_key', 'name', 'connection'}} where
+                   connection is the peer's asyncio.StreamWriter
+            version: number of membership changes so far
+        """
         self.host = host
         self.port = port
+        self.sample_size = sample_size
         self.peers = {}
-        self.lock = threading.Lock()
+        self.version = 0
 
     def start(self):
         """
-        Starts the Tracker server.
-        
-        Listens for incoming peer connections and spawns a thread to handle each peer.
+        Starts the Tracker server. Blocks, running the event loop.
+        """
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """
+        Listens for incoming peer connections and serves each on the loop.
         """
-        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_sock.bind((self.host, self.port))
-        server_sock.listen()
+        server = await asyncio.start_server(self.handle_peer, self.host, self.port, reuse_address=True)
         print(f"[Tracker] Listening on {self.host}:{self.port}...")
+        async with server:
+            await server.serve_forever()
 
-        while True:
-            client_sock, addr = server_sock.accept()
-            t = threading.Thread(target=self.handle_peer, args=(client_sock, addr))
-            t.start()
-    
-    def handle_peer(self, client_sock, addr):
+    async def handle_peer(self, reader, writer):
         """
         Handles an individual peer connection.
-        
-        Expects a 3-byte 'SYN' handshake, sends back the peer list,
-        and monitors for connection closure.
+
+        Expects a 3-byte 'SYN' handshake and a "port|public_key|name" line,
+        sends back the peer list and the member list, then answers RESYNC
+        requests until the connection closes.
         """
+        addr = writer.get_extra_info("peername")
         peer_id = None
         try:
-            syn = client_sock.recv(3)
+            syn = await reader.readexactly(3)
             if syn != b"SYN":
                 print(f"[Tracker] Invalid handshake from {addr}, closing connection.")
-                client_sock.close()
                 return
-        
-            info = client_sock.recv(1024).decode().strip()
+
+            info = (await reader.readline()).decode().strip()
             try:
                 port_data, public_key, name = info.split("|", 2)
+                peer_listen_port = int(port_data)
             except ValueError:
                 print(f"[Tracker] Invalid peer info format from {addr}: {info}")
-                client_sock.close()
                 return
-            peer_listen_port = int(port_data)
-            ip = addr[0]
-            peer_id = f"{ip}:{peer_listen_port}"
-
-            with self.lock:
-                self.peers[peer_id] = {
-                    'public_key': public_key,
-                    'name': name,
-                    'connection': client_sock
-                }
+            peer_id = f"{addr[0]}:{peer_listen_port}"
+
+            self.peers[peer_id] = {
+                'public_key': public_key,
+                'name': name,
+                'connection': writer
+            }
+            self.version += 1
             print(f"[Tracker] Peer connected: {peer_id}")
-            
-            peer_ids = list(self.peers.keys())
-            client_sock.sendall(json.dumps(peer_ids).encode())
 
-            self.broadcast_public_keys_and_names()
+            writer.write((json.dumps(self.peer_list(peer_id)) + "\n").encode())
+            writer.write(self.members_message())
+            self.broadcast({"type": "join", "version": self.version, "public_key": public_key,
+                            "name": name, "address": peer_id}, exclude=peer_id)
 
             while True:
-                data = client_sock.recv(1024)
-                if not data:
+                line = await reader.readline()
+                if not line:
                     break
+                if line.strip() == b"RESYNC":
+                    writer.write(self.members_message())
 
-        except Exception as e:
+        except (OSError, asyncio.IncompleteReadError) as e:
             print(f"[Tracker] Error handling peer: {e}")
 
         finally:
-            self.unregister_peer(peer_id)
-            try:
-                client_sock.close()
-            except:
-                pass
-    
-    def unregister_peer(self, peer_id):
-        """
-        Removes a peer from all tracking lists when the peer disconnects.
-        """
-        with self.lock:
-            if peer_id and peer_id in self.peers:
-                del self.peers[peer_id]
-                print(f"[Tracker] Peer disconnected: {peer_id}")
-            elif peer_id:
+            self.unregister_peer(peer_id, writer)
+            writer.close()
+
+    def peer_list(self, peer_id):
+        """
+        The peers a joining peer connects to: all of them, or a random
+        sample_size of the others when the network is a bounded-degree overlay.
+        """
+        if self.sample_size is None:
+            return list(self.peers.keys())
+        others = [other for other in self.peers if other != peer_id]
+        return random.sample(others, min(self.sample_size, len(others)))
+
+    def members_message(self) -> bytes:
+        """
+        The full member list at the current version, sent on join and RESYNC:
+        [public_key, name, address] of every peer.
+        """
+        members = [[peer_data['public_key'], peer_data['name'], peer_id]
+                   for peer_id, peer_data in self.peers.items()]
+        return (json.dumps({"type": "members", "version": self.version, "members": members}) + "\n").encode()
+
+    def unregister_peer(self, peer_id, writer=None):
+        """
+        Removes a peer when it disconnects and tells the others it left.
+        """
+        peer_data = self.peers.get(peer_id) if peer_id else None
+        if peer_data is None or (writer is not None and peer_data['connection'] is not writer):
+            if peer_id:
                 print(f"[Tracker] Tried to unregister unknown peer: {peer_id}")
-        self.broadcast_public_keys_and_names()
+            return
+        del self.peers[peer_id]
+        self.version += 1
+        print(f"[Tracker] Peer disconnected: {peer_id}")
+        self.broadcast({"type": "leave", "version": self.version, "public_key": peer_data['public_key'],
+                        "address": peer_id})
 
-    def broadcast_public_keys_and_names(self):
+    def broadcast(self, update, exclude=None):
         """
-        Broadcasts the current list of public keys and names to all connected peers.
+        Sends a membership delta to all connected peers. Writes only queue on
+        the loop; a peer that lets MAX_TRACKER_BUFFER bytes pile up is dropped.
         """
-        with self.lock:
-            public_keys = [peer_data['public_key'] for peer_data in self.peers.values()]
-            names = [peer_data['name'] for peer_data in self.peers.values()]
-            public_keys_str = json.dumps(public_keys)
-            names_str = json.dumps(names)
-            combined = f"{public_keys_str}|{names_str}\n".encode()
-            for peer_id, peer_data in list(self.peers.items()):
-                try:
-                    peer_data['connection'].sendall(combined)
-                except Exception:
-                    print(f"[Tracker] Failed to send to peer {peer_id}, removing connection")
-                    del self.peers[peer_id]
+        line = (json.dumps(update) + "\n").encode()
+        for peer_id, peer_data in list(self.peers.items()):
+            if peer_id == exclude:
+                continue
+            writer = peer_data['connection']
+            if writer.transport.get_write_buffer_size() > MAX_TRACKER_BUFFER:
+                print(f"[Tracker] Peer {peer_id} is not reading, removing connection")
+                writer.close()
+                continue
+            writer.write(line)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Tracker for managing peers.")
     parser.add_argument('--host', type=str, default='0.0.0.0', help='Host IP to bind to (default: 0.0.0.0)')
     parser.add_argument('--port', type=int, default=8000, help='Port to bind to (default: 8000)')
+    parser.add_argument('--sample', type=int, default=None,
+                        help='Give joining peers this many random peers instead of all (default: all)')
     args = parser.parse_args()
 
-    tracker = Tracker(host=args.host, port=args.port)
-    tracker.start()
\ No newline at end of file
+    tracker = Tracker(host=args.host, port=args.port, sample_size=args.sample)
+    tracker.start()
@@ -0,0 +1,39 @@
+import threading
+import time
+from network import Peer, AsyncPeer
+
+def run_peer(peer_class, port, name, tracker_host, tracker_port):
+    peer = peer_class(port=port, name=name, tracker_addr=tracker_host, tracker_port=tracker_port)
+    peer_thread = threading.Thread(target=peer.start, daemon=True)
+    peer_thread.start()
+    return peer
+
+def print_every_balance(peers):
+    for peer in peers:
+        print(peer[0] + ":")
+        peer[1].chain.print_balances()
+
+if __name__ == "__main__":
+    tracker_host = "localhost"
+    tracker_port = 8000
+
+    # async and threaded peers share the wire format, so they mix freely
+    sunny = run_peer(AsyncPeer, 5001, "Sunny", tracker_host, tracker_port)
+    time.sleep(3)
+    alvis = run_peer(Peer, 5002, "Alvis", tracker_host, tracker_port)
+    time.sleep(3)
+    sky = run_peer(AsyncPeer, 5003, "Sky", tracker_host, tracker_port)
+    time.sleep(20)
+
+    print("=== Starting Transactions ===")
+    sunny.transfer(receiver_public_key=alvis.wallet.public_key, amount=5.0)
+    time.sleep(5)
+    alvis.transfer(receiver_public_key=sky.wallet.public_key, amount=2.0)
+    time.sleep(5)
+    sky.transfer(receiver_public_key=sunny.wallet.public_key, amount=1.0)
+
+    time.sleep(20)
+    peers = [("Sunny", sunny), ("Alvis", alvis), ("Sky", sky)]
+    print_every_balance(peers)
+    for name, peer in peers:
+        print(f"{name} is at height {len(peer.chain.chain) - 1}, tip {peer.chain.tip_hash[:8]}")
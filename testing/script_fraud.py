@@ -2,8 +2,6 @@ import threading
 import time
 from network import Peer
 from blockchain import Block, Transaction
-import pickle
-import base64
 
 def run_peer(port, name, tracker_host, tracker_port):
     peer = Peer(port=port, name=name, tracker_addr=tracker_host, tracker_port=tracker_port)
@@ -34,12 +32,9 @@ if __name__ == "__main__":
     fraud_transaction = Transaction(37, sky.wallet, sunny.wallet.public_key) # Make sky pay sunny 37 bucks
     fraud_block = Block(0x64, [fraud_transaction])
 
-    pickled_block = pickle.dumps(fraud_block)
-    # Encode the bytes into a JSON-safe string
-    encoded_block = base64.b64encode(pickled_block).decode('utf-8')
     fraud_block_message = {
         "type": "block",
-        "data": encoded_block
+        "block": fraud_block
     }
 
     print("=== Starting Transactions ===")
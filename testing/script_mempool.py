@@ -0,0 +1,68 @@
+from blockchain import Chain, Transaction, Wallet
+
+# Runs without a network: two chains stand in for two peers, and blocks are
+# handed from one to the other with accept_block().
+
+def pay(chain, payer, payee, amount, receiving=False):
+    tx = Transaction(amount, payer, payee.public_key)
+    chain.recv_transaction(tx, payer.sign(tx), receiving)
+    return tx
+
+def reorg_returns_parent():
+    """
+        Sunny pays Alvis (t1, mined), Alvis pays Sky (t2, pending), then a
+        heavier branch without t1 arrives. t1 goes back to the mempool ahead
+        of t2, so both stay pending.
+    """
+    sunny, alvis, sky = Wallet("Sunny"), Wallet("Alvis"), Wallet("Sky")
+    chain, rival = Chain(), Chain()
+    block = chain.mine_block(sunny)
+    chain.add_block(block)
+    rival.accept_block(block)
+
+    t1 = pay(chain, sunny, alvis, 20)
+    chain.add_block(chain.mine_block(sunny))
+    t2 = pay(chain, alvis, sky, 10)
+
+    for _ in range(2):
+        block = rival.mine_block(sky)
+        rival.add_block(block)
+        print(f"Rival block: {chain.accept_block(block)}")
+
+    pending = [tx.txid for tx, _ in chain.mempool]
+    print(f"t1 pending: {t1.txid in pending}, t2 pending: {t2.txid in pending}")
+    assert pending == [t1.txid, t2.txid]
+    print(f"Alvis's effective balance: {chain.get_effective_balance(alvis)}")
+    assert chain.get_effective_balance(alvis) == 10
+
+def child_before_parent():
+    """
+        A gossiped payment from Alvis to Sky (t2) arrives before the one
+        from Sunny to Alvis that pays for it (t1). Both stay pending when
+        the next block arrives without them.
+    """
+    sunny, alvis, sky = Wallet("Sunny"), Wallet("Alvis"), Wallet("Sky")
+    chain, rival = Chain(), Chain()
+    block = rival.mine_block(sunny)
+    rival.add_block(block)
+    chain.accept_block(block)
+
+    # relayed transactions skip the balance check, so t2 gets in first
+    t2 = pay(chain, alvis, sky, 10, receiving=True)
+    t1 = pay(chain, sunny, alvis, 20, receiving=True)
+
+    block = rival.mine_block(sky)
+    rival.add_block(block)
+    print(f"Rival block: {chain.accept_block(block)}")
+
+    pending = [tx.txid for tx, _ in chain.mempool]
+    print(f"t1 pending: {t1.txid in pending}, t2 pending: {t2.txid in pending}")
+    assert pending == [t2.txid, t1.txid]
+    print(f"Alvis's effective balance: {chain.get_effective_balance(alvis)}")
+    assert chain.get_effective_balance(alvis) == 10
+
+if __name__ == "__main__":
+    print("=== Reorg returns a parent of a pending transaction ===")
+    reorg_returns_parent()
+    print("=== Gossiped child arrives before its parent ===")
+    child_before_parent()
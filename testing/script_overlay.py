@@ -0,0 +1,41 @@
+import threading
+import time
+from network import Peer
+
+NAMES = ["Sunny", "Alvis", "John", "Sky", "Haruki", "William"]
+
+def run_peer(port, name, tracker_host, tracker_port):
+    # every peer keeps 2 outbound links and accepts at most 4, instead of
+    # connecting to everyone
+    peer = Peer(port=port, name=name, tracker_addr=tracker_host, tracker_port=tracker_port,
+                outbound_links=2, inbound_links=4)
+    peer_thread = threading.Thread(target=peer.start, daemon=True)
+    peer_thread.start()
+    return peer
+
+if __name__ == "__main__":
+    tracker_host = "localhost"
+    tracker_port = 8000
+
+    peers = []
+    for i, name in enumerate(NAMES):
+        peers.append((name, run_peer(5001 + i, name, tracker_host, tracker_port)))
+        time.sleep(2)
+    time.sleep(15)
+
+    for name, peer in peers:
+        print(f"{name} has {len(peer.peers)} links, {len(peer.dialed)} of them outbound")
+
+    print("=== Starting Transactions ===")
+    sunny, william = peers[0][1], peers[-1][1]
+    sunny.transfer(receiver_public_key=william.wallet.public_key, amount=5.0)
+    time.sleep(5)
+    william.transfer(receiver_public_key=sunny.wallet.public_key, amount=2.0)
+
+    time.sleep(25)
+    for name, peer in peers:
+        print(f"{name} is at height {len(peer.chain.chain) - 1}, tip {peer.chain.tip_hash[:8]}")
+    print("Sunny's balances:")
+    sunny.chain.print_balances()
+    print("William's balances:")
+    william.chain.print_balances()
@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from network import Peer
+
+# Sunny keeps her blocks on disk in both sessions
+DATA_DIR = os.path.join(tempfile.gettempdir(), "blockchain_restart")
+
+def run_peer(port, name, tracker_host, tracker_port, data_dir=None):
+    peer = Peer(port=port, name=name, tracker_addr=tracker_host, tracker_port=tracker_port, data_dir=data_dir)
+    # snapshot every block, one below the tip, so the second session
+    # restores one although the first only mines a few blocks
+    peer.chain.snapshot_interval = 1
+    peer.chain.snapshot_depth = 1
+    peer_thread = threading.Thread(target=peer.start, daemon=True)
+    peer_thread.start()
+    return peer
+
+def first_session(tracker_host, tracker_port):
+    sunny = run_peer(5001, "Sunny", tracker_host, tracker_port, DATA_DIR)
+    time.sleep(3)
+    alvis = run_peer(5002, "Alvis", tracker_host, tracker_port)
+    time.sleep(25)
+
+    print("=== Starting Transactions ===")
+    alvis.transfer(receiver_public_key=sunny.wallet.public_key, amount=5.0)
+    time.sleep(20)
+
+    print(f"=== Sunny stops at height {len(sunny.chain.chain) - 1}, tip {sunny.chain.tip_hash[:8]} ===")
+    sunny.chain.print_balances()
+    sunny.chain.chain.store.flush()
+
+def second_session(tracker_host, tracker_port):
+    # prints "Restored state at height ..." and replays only the blocks after it
+    sunny = run_peer(5001, "Sunny", tracker_host, tracker_port, DATA_DIR)
+    print(f"=== Sunny restarts at height {len(sunny.chain.chain) - 1}, tip {sunny.chain.tip_hash[:8]} ===")
+    sunny.chain.print_balances()
+    time.sleep(3)
+    john = run_peer(5003, "John", tracker_host, tracker_port) # syncs from Sunny's stored chain
+    time.sleep(30)
+
+    print(f"Sunny is at height {len(sunny.chain.chain) - 1}, tip {sunny.chain.tip_hash[:8]}")
+    print(f"John is at height {len(john.chain.chain) - 1}, tip {john.chain.tip_hash[:8]}")
+    print("John's balances:")
+    john.chain.print_balances()
+
+if __name__ == "__main__":
+    tracker_host = "localhost"
+    tracker_port = 8000
+
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+    # each session is its own process, so the second one really starts
+    # from what the first left on disk
+    for session in (first_session, second_session):
+        process = multiprocessing.Process(target=session, args=(tracker_host, tracker_port))
+        process.start()
+        process.join()